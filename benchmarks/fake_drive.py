@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import email
+import hashlib
+import itertools
+import json
+import re
+import secrets
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlsplit
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+DOCUMENT_MIME_TYPE = 'application/vnd.google-apps.document'
+ROOT_ID = 'root-folder'
+PATTERN = bytes(range(256))
+
+# Query clauses the app sends to files.list, e.g. `"x" in parents`, `name contains "x"`, `trashed=false`.
+CLAUSES = [
+    (re.compile(r'''^["'](.+)["'] in parents$'''), lambda value: lambda file: value in file['parents']),
+    (re.compile(r'''^name = ["'](.*)["']$'''), lambda value: lambda file: file['name'] == value),
+    (re.compile(r'''^name contains ["'](.*)["']$'''), lambda value: lambda file: value in file['name']),
+    (re.compile(r'''^mimeType ?= ?["'](.*)["']$'''), lambda value: lambda file: file['mimeType'] == value),
+    (re.compile(r'''^mimeType ?!= ?["'](.*)["']$'''), lambda value: lambda file: file['mimeType'] != value),
+    (re.compile(r'^trashed ?= ?(true|false)$'), lambda value: lambda file: file['trashed'] == (value == 'true')),
+]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def _content(size: int) -> bytes:
+    return (PATTERN * (size // len(PATTERN) + 1))[:size]
+
+
+class FakeDrive:
+    # An in-memory Drive v3 with just the behaviour the app relies on; every call returns all fields.
+
+    def __init__(self, folders: int, files_per_folder: int, file_size: int, max_page_size: int):
+        self.max_page_size = max_page_size
+        self.files = {}
+        self.contents = {}
+        self.uploads = {}
+        self.ids = itertools.count()
+        self._add({'id': ROOT_ID, 'name': 'My Drive', 'mimeType': FOLDER_MIME_TYPE, 'parents': []})
+        for folder in range(folders):
+            folder_id = self._add({'id': f'folder-{folder}', 'name': f'folder-{folder}', 'mimeType': FOLDER_MIME_TYPE})
+            self._add({'id': f'doc-{folder}', 'name': f'doc-{folder}', 'mimeType': DOCUMENT_MIME_TYPE})
+            for number in range(files_per_folder):
+                file_id = f'file-{folder}-{number}'
+                self._add({'id': file_id, 'name': f'{file_id}.bin', 'mimeType': 'application/octet-stream'},
+                          folder_id, _content(file_size))
+
+    def _add(self, file: dict, parent: str = ROOT_ID, content: bytes | None = None) -> str:
+        file = {'parents': [parent], 'trashed': False, 'modifiedTime': _now(), 'version': '1', **file}
+        self.files[file['id']] = file
+        if content is not None:
+            self._set_content(file, content)
+        return file['id']
+
+    def _set_content(self, file: dict, content: bytes):
+        self.contents[file['id']] = content
+        md5 = hashlib.md5(content).hexdigest()
+        file.update(size=str(len(content)), md5Checksum=md5, headRevisionId=md5, modifiedTime=_now())
+        file['version'] = str(int(file['version']) + 1)
+
+    def _get(self, file_id: str) -> dict | None:
+        return self.files.get(ROOT_ID if file_id == 'root' else file_id)
+
+    def _update(self, file: dict, body: dict, params: dict) -> dict:
+        file.update({key: value for key, value in body.items() if key in ('name', 'trashed', 'mimeType')})
+        if params.get('removeParents'):
+            removed = params['removeParents'].split(',')
+            file['parents'] = [parent for parent in file['parents'] if parent not in removed]
+        if params.get('addParents'):
+            file['parents'] += params['addParents'].split(',')
+        file['modifiedTime'] = _now()
+        file['version'] = str(int(file['version']) + 1)
+        return file
+
+    def _list(self, params: dict) -> dict:
+        predicates = [lambda file: file['id'] != ROOT_ID]
+        for clause in filter(None, (clause.strip() for clause in params.get('q', '').split(' and '))):
+            for pattern, predicate in CLAUSES:
+                if match := pattern.match(clause):
+                    predicates.append(predicate(match.group(1)))
+                    break
+            else:
+                raise ValueError(f'Unsupported query: {clause}')
+        matching = [file for file in self.files.values() if all(predicate(file) for predicate in predicates)]
+        offset = int(params.get('pageToken') or 0)
+        page_size = min(int(params.get('pageSize', 100)), self.max_page_size)
+        response = {'files': matching[offset:offset + page_size]}
+        if offset + page_size < len(matching):
+            response['nextPageToken'] = str(offset + page_size)
+        return response
+
+    def _media(self, content: bytes, headers: dict) -> tuple[int, dict, bytes]:
+        match = re.match(r'bytes=(\d+)-(\d*)', headers.get('range', ''))
+        if not match:
+            return 200, {'content-type': 'application/octet-stream'}, content
+        start = int(match.group(1))
+        end = min(int(match.group(2) or len(content) - 1), len(content) - 1)
+        if start >= len(content):
+            return 416, {'content-range': f'bytes */{len(content)}'}, b''
+        return 206, {'content-range': f'bytes {start}-{end}/{len(content)}'}, content[start:end + 1]
+
+    def _upload(self, file_id: str | None, params: dict, headers: dict, body: bytes, base_url: str):
+        if params.get('uploadType') == 'resumable':
+            upload_id = secrets.token_hex(8)
+            metadata = json.loads(body or b'{}')
+            if 'x-upload-content-type' in headers:
+                metadata.setdefault('mimeType', headers['x-upload-content-type'])
+            self.uploads[upload_id] = (file_id, metadata, bytearray(), base_url)
+            return 200, {'location': f'{base_url}upload/session/{upload_id}'}, b''
+        # Simple and multipart uploads are not used by the app; store the raw body as content.
+        return self._finish_upload(file_id, {}, body, base_url)
+
+    def _finish_upload(self, file_id: str | None, metadata: dict, content: bytes, base_url: str):
+        if file_id:
+            file = self._update(self._get(file_id), metadata, {})
+        else:
+            file_id = f'upload-{next(self.ids)}'
+            parents = metadata.get('parents') or [ROOT_ID]
+            mime_type = metadata.get('mimeType', 'application/octet-stream')
+            file = self.files[self._add(
+                {'id': file_id, 'name': metadata.get('name', file_id), 'mimeType': mime_type}, parents[0],
+            )]
+        self._set_content(file, bytes(content))
+        if file['mimeType'].startswith('image/'):
+            file['thumbnailLink'] = f'{base_url}thumbnails/{file["id"]}=s220'
+        if metadata.get('modifiedTime'):
+            file['modifiedTime'] = metadata['modifiedTime']
+        return 200, {}, file
+
+    def _upload_chunk(self, upload_id: str, headers: dict, body: bytes):
+        file_id, metadata, content, base_url = self.uploads[upload_id]
+        content += body
+        # Without Content-Range (an empty file) the request carries the whole upload.
+        total = headers.get('content-range', f'/{len(content)}').rpartition('/')[2]
+        if total.isdigit() and len(content) >= int(total):
+            del self.uploads[upload_id]
+            return self._finish_upload(file_id, metadata, content, base_url)
+        return 308, {'range': f'bytes=0-{len(content) - 1}'}, b''
+
+    def handle(self, method: str, path: str, params: dict, headers: dict, body: bytes, base_url: str):
+        path = path.rstrip('/')
+        if match := re.fullmatch(r'/upload/session/(\w+)', path):
+            return self._upload_chunk(match.group(1), headers, body)
+        if match := re.fullmatch(r'/upload/drive/v3/files(?:/([^/]+))?', path):
+            return self._upload(match.group(1), params, headers, body, base_url)
+        if match := re.fullmatch(r'/thumbnails/([^/=]+)=s\d+', path):
+            # Drive serves a resized rendition; the original is close enough for the app, which resizes it again.
+            content = self.contents.get(match.group(1))
+            if content is None:
+                return 404, {}, {'error': {'code': 404, 'message': f'No thumbnail: {path}'}}
+            return 200, {'content-type': self.files[match.group(1)]['mimeType']}, content
+        if path == '/drive/v3/about':
+            return 200, {}, {'user': {'permissionId': 'benchmark-user', 'displayName': 'Benchmark'}}
+        if path == '/drive/v3/changes/startPageToken':
+            return 200, {}, {'startPageToken': '1'}
+        if path == '/drive/v3/changes':
+            return 200, {}, {'changes': [], 'newStartPageToken': params.get('pageToken', '1')}
+        if path == '/drive/v3/files' and method == 'GET':
+            return 200, {}, self._list(params)
+        if path == '/drive/v3/files' and method == 'POST':
+            metadata = json.loads(body or b'{}')
+            parents = metadata.pop('parents', None) or [ROOT_ID]
+            file_id = self._add({'id': f'created-{next(self.ids)}', 'name': 'Untitled', **metadata}, parents[0])
+            return 200, {}, self.files[file_id]
+        if path == '/drive/v3/files/trash' and method == 'DELETE':
+            for file in [file for file in self.files.values() if file['trashed']]:
+                del self.files[file['id']]
+            return 204, {}, b''
+        match = re.fullmatch(r'/drive/v3/files/([^/]+)(/export)?', path)
+        file = match and self._get(match.group(1))
+        if not file:
+            return 404, {}, {'error': {'code': 404, 'message': f'File not found: {path}'}}
+        if match.group(2):
+            return self._media(_content(1024) + file['name'].encode(), headers)
+        if method == 'GET' and params.get('alt') == 'media':
+            return self._media(self.contents.get(file['id'], b''), headers)
+        if method == 'GET':
+            return 200, {}, file
+        if method == 'PATCH':
+            return 200, {}, self._update(file, json.loads(body or b'{}'), params)
+        if method == 'DELETE':
+            del self.files[file['id']]
+            return 204, {}, b''
+        return 405, {}, {'error': {'code': 405, 'message': f'{method} {path}'}}
+
+    def handle_batch(self, content_type: str, body: bytes, base_url: str) -> tuple[int, dict, bytes]:
+        message = email.message_from_bytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + body)
+        boundary = secrets.token_hex(16)
+        parts = []
+        for part in message.get_payload():
+            head, _, request_body = part.get_payload().replace('\r\n', '\n').partition('\n\n')
+            request_line, *header_lines = head.split('\n')
+            method, target, _ = request_line.split(' ')
+            url = urlsplit(target)
+            headers = {key.lower(): value.strip() for key, _, value in (line.partition(':') for line in header_lines)}
+            status, _, result = self.handle(
+                method, url.path, dict(parse_qsl(url.query)), headers, request_body.encode(), base_url,
+            )
+            payload = result if isinstance(result, bytes) else json.dumps(result).encode()
+            parts.append(
+                f'--{boundary}\r\nContent-Type: application/http\r\n'
+                f'Content-ID: <response-{part["Content-ID"].strip("<>")}>\r\n\r\n'
+                f'HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n'.encode() + payload + b'\r\n',
+            )
+        body = b''.join(parts) + f'--{boundary}--\r\n'.encode()
+        return 200, {'content-type': f'multipart/mixed; boundary={boundary}'}, body
+
+
+def create_app(drive: FakeDrive, latency: float) -> Starlette:
+
+    async def token(request: Request):
+        await asyncio.sleep(latency)
+        return Response(json.dumps({
+            'access_token': secrets.token_urlsafe(16),
+            'refresh_token': secrets.token_urlsafe(16),
+            'expires_in': 3600,
+            'token_type': 'Bearer',
+            'scope': 'https://www.googleapis.com/auth/drive',
+        }), media_type='application/json')
+
+    async def api(request: Request):
+        await asyncio.sleep(latency)
+        body = await request.body()
+        base_url = str(request.base_url)
+        try:
+            if request.url.path.startswith('/batch/'):
+                status, headers, result = drive.handle_batch(request.headers['content-type'], body, base_url)
+            else:
+                status, headers, result = drive.handle(
+                    request.method, request.url.path, dict(request.query_params), dict(request.headers), body,
+                    base_url,
+                )
+        except ValueError as error:
+            status, headers, result = 400, {}, {'error': {'code': 400, 'message': str(error)}}
+        if not isinstance(result, bytes):
+            result = json.dumps(result).encode()
+            headers = {'content-type': 'application/json', **headers}
+        return Response(result, status_code=status, headers=headers)
+
+    methods = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+    return Starlette(routes=[Route('/token', token, methods=['POST']), Route('/{path:path}', api, methods=methods)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Drive v3 API and the OAuth token endpoint')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds added to every request')
+    parser.add_argument('--folders', type=int, default=10)
+    parser.add_argument('--files-per-folder', type=int, default=100)
+    parser.add_argument('--file-size', type=int, default=256 * 1024)
+    parser.add_argument('--max-page-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    drive = FakeDrive(args.folders, args.files_per_folder, args.file_size, args.max_page_size)
+    uvicorn.run(create_app(drive, args.latency), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+SCENARIOS = ['callback', 'folders_and_files', 'search', 'download', 'create_files']
+
+
+@dataclass
+class Result:
+    name: str
+    timings: list[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0
+
+    def report(self) -> str:
+        timings = sorted(self.timings) or [0]
+        p50 = statistics.median(timings)
+        p99 = timings[max(int(len(timings) * 0.99) - 1, 0)]
+        throughput = len(self.timings) / self.elapsed if self.elapsed else 0
+        return (
+            f'{self.name:<18} {len(self.timings):>6} req  {self.errors:>4} err  {throughput:8.1f} req/s  '
+            f'p50 {p50:8.2f} ms  p99 {p99:8.2f} ms'
+        )
+
+
+def start(command: list[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen(command, cwd=ROOT_DIR, env={**os.environ, **env})
+
+
+async def wait_until_up(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+def peak_rss(pid: int) -> int | None:
+    # VmHWM is the resident set high-water mark of the process, in kB.
+    try:
+        status = Path(f'/proc/{pid}/status').read_text()
+    except OSError:
+        return None
+    for line in status.splitlines():
+        if line.startswith('VmHWM:'):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+async def login(client: httpx.AsyncClient) -> httpx.Response:
+    return await client.get('/auth/callback', params={'code': 'benchmark'})
+
+
+def scenario_request(name: str, client: httpx.AsyncClient, number: int, args):
+    folder, file = number % args.folders, number % args.files_per_folder
+    if name == 'callback':
+        return login(client)
+    if name == 'folders_and_files':
+        return client.get('/drive/folders_and_files', params={'file_id': f'folder-{folder}'})
+    if name == 'search':
+        return client.get('/drive/search', params={'file_name': f'file-{folder}-{file}.bin'})
+    if name == 'download':
+        return client.get('/drive/download', params={'file_id': f'file-{folder}-{file}'})
+    payload = os.urandom(args.upload_size)
+    return client.post('/drive/create_files', files=[('files', (f'upload-{number}.bin', payload))])
+
+
+async def run_scenario(name: str, client: httpx.AsyncClient, requests: int, args) -> Result:
+    result = Result(name)
+    numbers = iter(range(requests))
+
+    async def worker():
+        for number in numbers:
+            started = time.perf_counter()
+            try:
+                response = await scenario_request(name, client, number, args)
+                # Redirects are the success answer of the callback and of uploads.
+                if response.status_code >= 400:
+                    result.errors += 1
+            except httpx.HTTPError:
+                result.errors += 1
+            result.timings.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+async def run(args, app_pid: int | None):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.app_url, limits=limits, timeout=120) as client:
+        response = await login(client)
+        if 'session_id' not in response.cookies:
+            sys.exit(f'Login through the fake token endpoint failed: {response.status_code} {response.text[:200]}')
+        client.cookies.set('session_id', response.cookies['session_id'])
+        for name in args.scenarios:
+            if args.warmup:
+                await run_scenario(name, client, args.warmup, args)
+            print((await run_scenario(name, client, args.requests, args)).report())
+    if app_pid:
+        rss = peak_rss(app_pid)
+        print(f'peak RSS           {rss / 1024 / 1024:8.1f} MiB' if rss else 'peak RSS           unavailable')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load test the app against benchmarks/fake_drive.py. Redis must be reachable with the usual '
+                    'REDIS_HOST/REDIS_PORT settings.',
+    )
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--requests', type=int, default=500, help='Requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--upload-size', type=int, default=256 * 1024)
+    parser.add_argument('--app-url', help='Benchmark an already running app instead of starting one')
+    parser.add_argument('--app-port', type=int, default=8090)
+    parser.add_argument('--drive-port', type=int, default=8091)
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds the fake Drive adds to every call')
+    parser.add_argument('--folders', type=int, default=10)
+    parser.add_argument('--files-per-folder', type=int, default=100)
+    parser.add_argument('--file-size', type=int, default=256 * 1024)
+    parser.add_argument('--max-page-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    drive_url = f'http://127.0.0.1:{args.drive_port}/'
+    processes = [start([
+        sys.executable, '-m', 'benchmarks.fake_drive', '--port', str(args.drive_port),
+        '--latency', str(args.latency), '--folders', str(args.folders),
+        '--files-per-folder', str(args.files_per_folder), '--file-size', str(args.file_size),
+        '--max-page-size', str(args.max_page_size),
+    ], {})]
+    app_pid = None
+    if not args.app_url:
+        args.app_url = f'http://127.0.0.1:{args.app_port}'
+        app = start([
+            sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(args.app_port), '--log-level', 'warning',
+        ], {
+            'DRIVE_ROOT_URL': drive_url,
+            'GOOGLE_OAUTH_TOKEN_URL': f'{drive_url}token',
+            'REDIRECT_URL': f'{args.app_url}/auth/callback',
+        })
+        processes.append(app)
+        app_pid = app.pid
+    try:
+        asyncio.run(wait_until_up(drive_url))
+        asyncio.run(wait_until_up(args.app_url))
+        asyncio.run(run(args, app_pid))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import statistics
+import time
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+from src.drive.service import get_service
+
+
+def legacy_get_service(credentials):
+    return build('drive', 'v3', credentials=credentials)
+
+
+def measure(factory, iterations: int) -> list[float]:
+    timings = []
+    for i in range(iterations):
+        credentials = Credentials(f'token-{i}')
+        started = time.perf_counter()
+        factory(credentials).files().list(q='trashed=false')
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def report(name: str, timings: list[float]):
+    timings = sorted(timings)
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    mean, p50 = statistics.mean(timings), statistics.median(timings)
+    print(f'{name:<10} mean {mean:8.3f} ms  p50 {p50:8.3f} ms  p99 {p99:8.3f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-request Drive service construction overhead')
+    parser.add_argument('--iterations', type=int, default=500)
+    args = parser.parse_args()
+
+    legacy = measure(legacy_get_service, args.iterations)
+    cached = measure(get_service, args.iterations)
+    report('build()', legacy)
+    report('factory', cached)
+    print(f'speedup    x{statistics.mean(legacy) / statistics.mean(cached):.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,35 @@
 import logging
+import math
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
-from redis import asyncio as aioredis
 from starlette.middleware.cors import CORSMiddleware
 
 from src.auth.router import router as auth_router
-from src.config import REDIS_HOST, REDIS_PORT
+from src.drive import executor as drive_executor
+from src.drive import jobs, prefetch
 from src.drive.router import router as drive_router
+from src.drive.upstream import UpstreamUnavailable
+from src.logs import setup_logging
+from src.metrics import MetricsMiddleware, render
+from src.redis_client import redis
 
-logging.basicConfig(filename='app.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+log_listener = setup_logging()
 
 
 @asynccontextmanager
 async def lifespan(_):
-    redis = aioredis.from_url(f'redis://{REDIS_HOST}:{REDIS_PORT}', encoding='utf-8', decode_responses=True)
     FastAPICache.init(RedisBackend(redis), prefix='fastapi-cache')
+    jobs.start_workers()
     yield
+    await jobs.stop_workers()
+    await prefetch.stop()
     FastAPICache.reset()
+    drive_executor.shutdown()
+    log_listener.stop()
 
 
 app = FastAPI(
@@ -28,20 +38,26 @@ app = FastAPI(
 )
 
 
-@app.middleware('http')
-async def log_requests(request: Request, call_next):
-    path = request.url.path
-    method = request.method
-    client_host = request.client.host
-    logging.info(f'User {client_host} accessed {method} {path}')
-    response = await call_next(request)
-    return response
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable(request: Request, error: UpstreamUnavailable):
+    return JSONResponse(
+        {'detail': error.detail}, status_code=error.status_code,
+        headers={'Retry-After': str(math.ceil(error.retry_after))},
+    )
+
+
+@app.get('/metrics', include_in_schema=False)
+async def metrics():
+    content, media_type = render()
+    return Response(content, media_type=media_type)
+
 
 origins = [
     'http://localhost:8000',
     'http://127.0.0.1:8000',
 ]
 
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
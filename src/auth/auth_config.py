@@ -4,11 +4,12 @@ from fastapi.security import OAuth2AuthorizationCodeBearer
 from fastapi.templating import Jinja2Templates
 from httpx_oauth.clients.google import GoogleOAuth2
 
-from src.config import BASE_DIR, GOOGLE_OAUTH_CLIENT_ID, GOOGLE_OAUTH_CLIENT_SECRET
+from src.auth.sessions import create_session_store
+from src.config import BASE_DIR, GOOGLE_OAUTH_CLIENT_ID, GOOGLE_OAUTH_CLIENT_SECRET, GOOGLE_OAUTH_TOKEN_URL
 
 oauth2_scheme = OAuth2AuthorizationCodeBearer(
     authorizationUrl='https://accounts.google.com/o/oauth2/auth',
-    tokenUrl='https://oauth2.googleapis.com/token',
+    tokenUrl=GOOGLE_OAUTH_TOKEN_URL,
 )
 
 SCOPES = [
@@ -28,8 +29,9 @@ oauth2_credentials = {
 }
 
 oauth2_client = GoogleOAuth2(**oauth2_credentials)
+oauth2_client.access_token_endpoint = oauth2_client.refresh_token_endpoint = GOOGLE_OAUTH_TOKEN_URL
 
-sessions = {}
+session_store = create_session_store()
 
 global logged_in
 
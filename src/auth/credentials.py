@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+import httpx
+from cachetools import TTLCache
+from google.oauth2.credentials import Credentials
+from httpx_oauth.oauth2 import OAuth2Error
+
+from src.auth.auth_config import SCOPES, oauth2_client, session_store
+from src.config import (
+    CREDENTIALS_CACHE_SIZE, CREDENTIALS_CACHE_TTL, GOOGLE_OAUTH_CLIENT_ID, GOOGLE_OAUTH_CLIENT_SECRET,
+    GOOGLE_OAUTH_TOKEN_URL, TOKEN_REFRESH_MARGIN,
+)
+
+# forget() only reaches this process, so entries expire and the session store is consulted again.
+_credentials: TTLCache = TTLCache(maxsize=CREDENTIALS_CACHE_SIZE, ttl=CREDENTIALS_CACHE_TTL)
+_refreshes: dict[str, asyncio.Task] = {}
+
+logger = logging.getLogger(__name__)
+
+
+def build_credentials(token: dict) -> Credentials:
+    # google-auth compares expiry against naive UTC datetimes.
+    expiry = None
+    if token.get('expires_at'):
+        expiry = datetime.fromtimestamp(token['expires_at'], timezone.utc).replace(tzinfo=None)
+    return Credentials(
+        token['access_token'],
+        refresh_token=token.get('refresh_token'),
+        token_uri=GOOGLE_OAUTH_TOKEN_URL,
+        client_id=GOOGLE_OAUTH_CLIENT_ID,
+        client_secret=GOOGLE_OAUTH_CLIENT_SECRET,
+        scopes=SCOPES,
+        expiry=expiry,
+    )
+
+
+def _expires_in(token: dict) -> float:
+    return token['expires_at'] - time.time() if token.get('expires_at') else float('inf')
+
+
+async def _refresh(session_id: str) -> Credentials | None:
+    token = await session_store.get(session_id)
+    if not token:
+        _credentials.pop(session_id, None)
+        return None
+    if _expires_in(token) > TOKEN_REFRESH_MARGIN or not token.get('refresh_token'):
+        # Another worker has already refreshed this session, or there is nothing to refresh with.
+        credentials = _credentials[session_id] = build_credentials(token)
+        return credentials
+    try:
+        refreshed = await oauth2_client.refresh_token(token['refresh_token'])
+    except OAuth2Error:
+        logger.warning('Refresh token rejected for session, logging it out')
+        await forget(session_id, delete=True)
+        return None
+    except httpx.HTTPError:
+        logger.exception('Token refresh failed')
+        return _credentials.get(session_id)
+    # Google does not repeat the refresh token in refresh responses.
+    token = {**token, **refreshed}
+    await session_store.set(session_id, token)
+    credentials = _credentials[session_id] = build_credentials(token)
+    return credentials
+
+
+def _refresh_done(session_id: str, task: asyncio.Task):
+    _refreshes.pop(session_id, None)
+    # A proactive refresh has no one awaiting it, so an unexpected error is logged here.
+    if not task.cancelled() and task.exception():
+        logger.error('Token refresh failed', exc_info=task.exception())
+
+
+def _start_refresh(session_id: str) -> asyncio.Task:
+    task = _refreshes.get(session_id)
+    if task is None:
+        task = _refreshes[session_id] = asyncio.create_task(_refresh(session_id))
+        task.add_done_callback(lambda done: _refresh_done(session_id, done))
+    return task
+
+
+def refresh(session_id: str) -> asyncio.Future:
+    # Shielded so a cancelled request does not cancel the refresh the other requests are waiting on.
+    return asyncio.shield(_start_refresh(session_id))
+
+
+async def get_credentials(session_id: str | None) -> Credentials | None:
+    if not session_id:
+        return None
+    credentials = _credentials.get(session_id)
+    if credentials is None:
+        token = await session_store.get(session_id)
+        if not token:
+            return None
+        credentials = _credentials[session_id] = build_credentials(token)
+    if credentials.expiry is None or not credentials.refresh_token:
+        return credentials
+    expires_in = (credentials.expiry.replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)).total_seconds()
+    if expires_in <= 0:
+        return await refresh(session_id)
+    if expires_in < TOKEN_REFRESH_MARGIN:
+        _start_refresh(session_id)
+    return credentials
+
+
+async def forget(session_id: str, delete: bool = False):
+    _credentials.pop(session_id, None)
+    if delete:
+        await session_store.delete(session_id)
@@ -1,10 +1,12 @@
+import secrets
 from typing import Optional
 
 from fastapi import APIRouter, Cookie, HTTPException, Request
 from fastapi.responses import HTMLResponse, RedirectResponse
 
-from src.auth.auth_config import oauth2_client, sessions, templates
-from src.config import REDIRECT_URL
+from src.auth.auth_config import oauth2_client, session_store, templates
+from src.auth.credentials import forget
+from src.config import REDIRECT_URL, SESSION_TTL
 
 router = APIRouter(
     prefix='/auth',
@@ -14,7 +16,10 @@ router = APIRouter(
 
 @router.get('/login', response_class=HTMLResponse)
 async def login_redirect(request: Request):
-    authorization_url = await oauth2_client.get_authorization_url(redirect_uri=REDIRECT_URL)
+    # Offline access with a forced consent prompt makes Google issue a refresh token for every session.
+    authorization_url = await oauth2_client.get_authorization_url(
+        redirect_uri=REDIRECT_URL, extras_params={'access_type': 'offline', 'prompt': 'consent'},
+    )
     return templates.TemplateResponse('login.html', {'request': request, 'authorization_url': authorization_url})
 
 
@@ -22,10 +27,10 @@ async def login_redirect(request: Request):
 async def callback(request: Request, code: str, state: Optional[str] = None):
     token = await oauth2_client.get_access_token(code=code, redirect_uri=REDIRECT_URL)
     if token:
-        session_id = str(hash(token['access_token']))
-        sessions[session_id] = token
+        session_id = secrets.token_urlsafe(32)
+        await session_store.set(session_id, token)
         response = RedirectResponse(url='/drive/folders_and_files')
-        response.set_cookie(key='session_id', value=session_id)
+        response.set_cookie(key='session_id', value=session_id, max_age=SESSION_TTL, httponly=True)
         return response
     else:
         raise HTTPException(status_code=400, detail='Failed to retrieve access token')
@@ -33,6 +38,8 @@ async def callback(request: Request, code: str, state: Optional[str] = None):
 
 @router.get('/logout')
 async def logout(request: Request, session_id: Optional[str] = Cookie(None)):
-    if session_id in sessions:
-        sessions.pop(session_id)
-    return RedirectResponse(url='/auth/login')
+    if session_id:
+        await forget(session_id, delete=True)
+    response = RedirectResponse(url='/auth/login')
+    response.delete_cookie(key='session_id', httponly=True)
+    return response
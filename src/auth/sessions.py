@@ -0,0 +1,69 @@
+import json
+import time
+from abc import ABC, abstractmethod
+
+from src.config import SESSION_BACKEND, SESSION_TTL
+from src.redis_client import redis
+
+
+class SessionStore(ABC):
+
+    @abstractmethod
+    async def get(self, session_id: str) -> dict | None:
+        ...
+
+    @abstractmethod
+    async def set(self, session_id: str, token: dict, ttl: int = SESSION_TTL):
+        ...
+
+    @abstractmethod
+    async def delete(self, session_id: str):
+        ...
+
+
+class InMemorySessionStore(SessionStore):
+
+    def __init__(self):
+        self._sessions: dict[str, tuple[float, dict]] = {}
+
+    async def get(self, session_id: str) -> dict | None:
+        expires_at, token = self._sessions.get(session_id, (0, None))
+        if expires_at < time.monotonic():
+            self._sessions.pop(session_id, None)
+            return None
+        return token
+
+    async def set(self, session_id: str, token: dict, ttl: int = SESSION_TTL):
+        self._sessions[session_id] = (time.monotonic() + ttl, token)
+
+    async def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+
+class RedisSessionStore(SessionStore):
+    key_prefix = 'session'
+
+    def _key(self, session_id: str) -> str:
+        return f'{self.key_prefix}:{session_id}'
+
+    async def get(self, session_id: str) -> dict | None:
+        value = await redis.get(self._key(session_id))
+        return None if value is None else json.loads(value)
+
+    async def set(self, session_id: str, token: dict, ttl: int = SESSION_TTL):
+        await redis.set(self._key(session_id), json.dumps(token), ex=ttl)
+
+    async def delete(self, session_id: str):
+        await redis.delete(self._key(session_id))
+
+
+SESSION_STORES = {
+    'memory': InMemorySessionStore,
+    'redis': RedisSessionStore,
+}
+
+
+def create_session_store(backend: str = SESSION_BACKEND) -> SessionStore:
+    if backend not in SESSION_STORES:
+        raise Exception(f'Unknown SESSION_BACKEND: {backend}')
+    return SESSION_STORES[backend]()
@@ -1,4 +1,5 @@
 import os
+import socket
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -20,5 +21,91 @@ if not SECRET:
 
 REDIRECT_URL = os.environ.get('REDIRECT_URL', '')
 
-REDIS_HOST = os.environ.get('REDIS_HOST')
-REDIS_PORT = os.environ.get('REDIS_PORT')
+# Overrides for pointing the app at benchmarks/fake_drive.py instead of Google.
+GOOGLE_OAUTH_TOKEN_URL = os.environ.get('GOOGLE_OAUTH_TOKEN_URL', 'https://oauth2.googleapis.com/token')
+DRIVE_ROOT_URL = os.environ.get('DRIVE_ROOT_URL', '')
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = os.environ.get('REDIS_PORT', 6379)
+
+DRIVE_EXECUTOR_WORKERS = int(os.environ.get('DRIVE_EXECUTOR_WORKERS', 256))
+DRIVE_HTTP_TIMEOUT = int(os.environ.get('DRIVE_HTTP_TIMEOUT', 60))
+
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+UPLOAD_CONCURRENCY = int(os.environ.get('UPLOAD_CONCURRENCY', 4))
+UPLOAD_MAX_RETRIES = int(os.environ.get('UPLOAD_MAX_RETRIES', 5))
+
+CACHE_LISTING_TTL = int(os.environ.get('CACHE_LISTING_TTL', 300))
+CACHE_METADATA_TTL = int(os.environ.get('CACHE_METADATA_TTL', 600))
+CACHE_TRASH_TTL = int(os.environ.get('CACHE_TRASH_TTL', 300))
+CHANGES_POLL_INTERVAL = int(os.environ.get('CHANGES_POLL_INTERVAL', 30))
+
+PAGE_SIZE = min(int(os.environ.get('PAGE_SIZE', 1000)), 1000)
+
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', 4))
+BULK_MAX_RETRIES = int(os.environ.get('BULK_MAX_RETRIES', 5))
+
+SEARCH_INDEX_ENABLED = os.environ.get('SEARCH_INDEX_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+SEARCH_INDEX_DIR = Path(os.environ.get('SEARCH_INDEX_DIR', BASE_DIR.parent / 'data' / 'search_index'))
+SEARCH_INDEX_SYNC_INTERVAL = int(os.environ.get('SEARCH_INDEX_SYNC_INTERVAL', 30))
+
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'redis')
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 7 * 24 * 60 * 60))
+
+TOKEN_REFRESH_MARGIN = int(os.environ.get('TOKEN_REFRESH_MARGIN', 300))
+CREDENTIALS_CACHE_SIZE = int(os.environ.get('CREDENTIALS_CACHE_SIZE', 10000))
+# How long a worker trusts a cached session before checking the store again, e.g. after a logout elsewhere.
+CREDENTIALS_CACHE_TTL = int(os.environ.get('CREDENTIALS_CACHE_TTL', 30))
+
+WALKER_CONCURRENCY = int(os.environ.get('WALKER_CONCURRENCY', 8))
+
+ZIP_PREFETCH_FILES = int(os.environ.get('ZIP_PREFETCH_FILES', 4))
+ZIP_BUFFER_CHUNKS = int(os.environ.get('ZIP_BUFFER_CHUNKS', 4))
+
+EXPORT_CACHE_DIR = Path(os.environ.get('EXPORT_CACHE_DIR', BASE_DIR.parent / 'data' / 'exports'))
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+BLOB_CACHE_DIR = Path(os.environ.get('BLOB_CACHE_DIR', BASE_DIR.parent / 'data' / 'blobs'))
+BLOB_CACHE_MAX_BYTES = int(os.environ.get('BLOB_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+BLOB_CACHE_MAX_FILE_SIZE = int(os.environ.get('BLOB_CACHE_MAX_FILE_SIZE', 100 * 1024 * 1024))
+
+LOG_FILE = os.environ.get('LOG_FILE', 'app.log')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+
+DRIVE_MAX_RETRIES = int(os.environ.get('DRIVE_MAX_RETRIES', 5))
+DRIVE_USER_RATE = float(os.environ.get('DRIVE_USER_RATE', 50))
+DRIVE_USER_BURST = int(os.environ.get('DRIVE_USER_BURST', 100))
+DRIVE_BREAKER_THRESHOLD = int(os.environ.get('DRIVE_BREAKER_THRESHOLD', 5))
+DRIVE_BREAKER_COOLDOWN = int(os.environ.get('DRIVE_BREAKER_COOLDOWN', 30))
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_TTL = int(os.environ.get('JOB_TTL', 24 * 60 * 60))
+JOB_PROGRESS_INTERVAL = float(os.environ.get('JOB_PROGRESS_INTERVAL', 0.5))
+JOB_KEEPALIVE_INTERVAL = float(os.environ.get('JOB_KEEPALIVE_INTERVAL', 15))
+JOB_SPOOL_DIR = Path(os.environ.get('JOB_SPOOL_DIR', BASE_DIR.parent / 'data' / 'jobs'))
+# Upload and sync jobs read files from the disk of the node that accepted them and only run there.
+JOB_NODE = os.environ.get('JOB_NODE', socket.gethostname())
+JOB_LEASE_TTL = int(os.environ.get('JOB_LEASE_TTL', 30))
+
+PREFETCH_ENABLED = os.environ.get('PREFETCH_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PREFETCH_FOLDERS = int(os.environ.get('PREFETCH_FOLDERS', 5))
+PREFETCH_FILES = int(os.environ.get('PREFETCH_FILES', 3))
+PREFETCH_BUDGET = int(os.environ.get('PREFETCH_BUDGET', 60))
+PREFETCH_BUDGET_WINDOW = int(os.environ.get('PREFETCH_BUDGET_WINDOW', 60))
+PREFETCH_CONCURRENCY = int(os.environ.get('PREFETCH_CONCURRENCY', 4))
+
+# /drive/sync only reaches directories below SYNC_ROOT and is disabled without it.
+SYNC_ROOT = Path(os.environ['SYNC_ROOT']) if os.environ.get('SYNC_ROOT') else None
+SYNC_MANIFEST_DIR = Path(os.environ.get('SYNC_MANIFEST_DIR', BASE_DIR.parent / 'data' / 'sync'))
+SYNC_CONCURRENCY = int(os.environ.get('SYNC_CONCURRENCY', 4))
+SYNC_BANDWIDTH = int(os.environ.get('SYNC_BANDWIDTH', 0))
+
+THUMBNAIL_CACHE_DIR = Path(os.environ.get('THUMBNAIL_CACHE_DIR', BASE_DIR.parent / 'data' / 'thumbnails'))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 256))
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', 80))
+THUMBNAIL_MAX_SOURCE_SIZE = int(os.environ.get('THUMBNAIL_MAX_SOURCE_SIZE', 50 * 1024 * 1024))
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', os.cpu_count() or 1))
+THUMBNAIL_CONCURRENCY = int(os.environ.get('THUMBNAIL_CONCURRENCY', 4))
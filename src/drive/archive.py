@@ -0,0 +1,142 @@
+import asyncio
+import posixpath
+import zipfile
+from collections import deque
+from datetime import datetime
+
+from google.oauth2.credentials import Credentials
+
+from src.config import ZIP_BUFFER_CHUNKS, ZIP_PREFETCH_FILES
+from src.drive.drive import iter_media
+from src.drive.executor import run_sync
+from src.drive.file_types_mapping import NATIVE_EXPORT_FORMATS
+from src.drive.service import get_service
+from src.drive.walker import FOLDER_MIME_TYPE, walk
+
+GOOGLE_APPS_PREFIX = 'application/vnd.google-apps.'
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+# zipfile writes to any object with write(); it falls back to data descriptors when it cannot seek.
+class ChunkWriter:
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _safe_name(name: str) -> str:
+    name = name.replace('/', '_').replace('\\', '_')
+    return '_' if name in ('', '.', '..') else name
+
+
+def _unique_path(used: set, path: str) -> str:
+    root, extension = posixpath.splitext(path)
+    candidate, number = path, 1
+    while candidate in used:
+        candidate = f'{root} ({number}){extension}'
+        number += 1
+    used.add(candidate)
+    return candidate
+
+
+def _date_time(file: dict) -> tuple:
+    if 'modifiedTime' not in file:
+        return ZIP_EPOCH
+    modified = datetime.fromisoformat(file['modifiedTime'].replace('Z', '+00:00'))
+    return max(modified.timetuple()[:6], ZIP_EPOCH)
+
+
+async def iter_members(service, folder_id: str, user_key: str | None, errors: list[str]):
+    paths = {folder_id: ''}
+    used = set()
+    async for current_id, files in walk(service, folder_id, user_key):
+        if isinstance(files, Exception):
+            errors.append(f'{paths[current_id] or "/"}: {files}')
+            continue
+        for file in files:
+            path = posixpath.join(paths[current_id], _safe_name(file['name']))
+            export_mime_type = None
+            if file['mimeType'] == FOLDER_MIME_TYPE:
+                paths[file['id']] = _unique_path(used, path)
+                continue
+            if file['mimeType'].startswith(GOOGLE_APPS_PREFIX):
+                if file['mimeType'] not in NATIVE_EXPORT_FORMATS:
+                    continue
+                export_mime_type, extension = NATIVE_EXPORT_FORMATS[file['mimeType']]
+                path = f'{path}.{extension}'
+            yield _unique_path(used, path), file, export_mime_type
+
+
+async def _fetch(service, file: dict, export_mime_type: str | None, queue: asyncio.Queue):
+    try:
+        if export_mime_type:
+            request = service.files().export_media(fileId=file['id'], mimeType=export_mime_type)
+        else:
+            request = service.files().get_media(fileId=file['id'])
+        async for chunk in iter_media(request):
+            await queue.put(chunk)
+        await queue.put(None)
+    except Exception as error:
+        await queue.put(error)
+
+
+async def stream_zip(credentials: Credentials | None, folder_id: str, user_key: str | None = None):
+    # Up to ZIP_PREFETCH_FILES members are downloaded ahead of the writer, each buffering at most
+    # ZIP_BUFFER_CHUNKS chunks, so memory stays bounded whatever the size of the folder.
+    service = get_service(credentials)
+    writer = ChunkWriter()
+    archive = zipfile.ZipFile(writer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True)
+    errors = []
+    members = iter_members(service, folder_id, user_key, errors)
+    pending = deque()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < ZIP_PREFETCH_FILES:
+                try:
+                    path, file, export_mime_type = await anext(members)
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                queue = asyncio.Queue(maxsize=ZIP_BUFFER_CHUNKS)
+                task = asyncio.create_task(_fetch(service, file, export_mime_type, queue))
+                pending.append((path, file, queue, task))
+            if not pending:
+                break
+
+            path, file, queue, _ = pending.popleft()
+            chunk = await queue.get()
+            if isinstance(chunk, Exception):
+                errors.append(f'{path}: {chunk}')
+                continue
+            with archive.open(zipfile.ZipInfo(path, _date_time(file)), 'w', force_zip64=True) as member:
+                while chunk is not None:
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    await run_sync(member.write, chunk)
+                    if data := writer.drain():
+                        yield data
+                    chunk = await queue.get()
+            if data := writer.drain():
+                yield data
+
+        if errors:
+            archive.writestr('errors.txt', '\n'.join(errors))
+        archive.close()
+        yield writer.drain()
+    finally:
+        for *_, task in pending:
+            task.cancel()
+        await members.aclose()
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from src.config import BLOB_CACHE_DIR, BLOB_CACHE_MAX_BYTES, BLOB_CACHE_MAX_FILE_SIZE, DOWNLOAD_CHUNK_SIZE
+from src.drive.executor import run_sync
+
+# Temporary files older than this were left behind by a crashed worker.
+ORPHAN_AGE = 24 * 60 * 60
+
+_filling: set[Path] = set()
+
+
+def blob_path(metadata: dict) -> Path | None:
+    # Only binary files have an md5Checksum or headRevisionId; both change with the content.
+    revision = metadata.get('md5Checksum') or metadata.get('headRevisionId')
+    if not revision or not BLOB_CACHE_MAX_BYTES:
+        return None
+    key = hashlib.sha256(f'{metadata["id"]}:{revision}'.encode()).hexdigest()
+    return Path(BLOB_CACHE_DIR, key[:2], key)
+
+
+def cacheable(metadata: dict) -> bool:
+    size = int(metadata.get('size', -1))
+    return 0 <= size <= min(BLOB_CACHE_MAX_FILE_SIZE, BLOB_CACHE_MAX_BYTES) and blob_path(metadata) is not None
+
+
+def touch(path: Path) -> bool:
+    # The modification time doubles as the last access time for LRU eviction.
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+async def lookup(metadata: dict) -> Path | None:
+    path = blob_path(metadata)
+    if path and await run_sync(touch, path):
+        return path
+    return None
+
+
+def _open_temporary(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return tempfile.NamedTemporaryFile(dir=path.parent, prefix=f'{path.name}.', suffix='.tmp', delete=False)
+
+
+def _discard(temporary):
+    temporary.close()
+    Path(temporary.name).unlink(missing_ok=True)
+
+
+def _commit(temporary, path: Path, expected_size: int | None):
+    temporary.close()
+    if expected_size is not None and os.path.getsize(temporary.name) != expected_size:
+        Path(temporary.name).unlink(missing_ok=True)
+        return False
+    os.replace(temporary.name, path)
+    return True
+
+
+async def write_through(chunks, path: Path, expected_size: int | None = None, on_commit=None):
+    # Chunks are passed on unchanged while written to a temporary file that only replaces path once complete.
+    # A second fill of the same path in this process just passes its chunks on.
+    if path in _filling:
+        async for chunk in chunks:
+            yield chunk
+        return
+    _filling.add(path)
+    try:
+        temporary = await run_sync(_open_temporary, path)
+        try:
+            async for chunk in chunks:
+                await run_sync(temporary.write, chunk)
+                yield chunk
+        except BaseException:
+            await run_sync(_discard, temporary)
+            raise
+        if await run_sync(_commit, temporary, path, expected_size) and on_commit:
+            await run_sync(on_commit, path)
+    finally:
+        _filling.discard(path)
+
+
+def evict_lru(directory: Path, max_bytes: int, keep: Path | None = None):
+    # Least recently used files go first until the files one level below directory fit in max_bytes again.
+    # keep, the file just written, is about to be served and is never removed.
+    blobs, total = [], 0
+    now = time.time()
+    for blob in Path(directory).glob('*/*'):
+        try:
+            stat = blob.stat()
+        except FileNotFoundError:
+            continue
+        if blob.suffix == '.tmp':
+            if now - stat.st_mtime > ORPHAN_AGE:
+                blob.unlink(missing_ok=True)
+            continue
+        blobs.append((stat.st_mtime, stat.st_size, blob))
+        total += stat.st_size
+    for _, size, blob in sorted(blobs):
+        if total <= max_bytes:
+            break
+        if blob == keep:
+            continue
+        blob.unlink(missing_ok=True)
+        total -= size
+
+
+def evict(path: Path | None = None):
+    evict_lru(BLOB_CACHE_DIR, BLOB_CACHE_MAX_BYTES, path)
+
+
+def _read(path: Path, offset: int, length: int) -> bytes:
+    with open(path, 'rb') as file:
+        return os.pread(file.fileno(), length, offset)
+
+
+async def iter_blob(path: Path, start: int, end: int):
+    offset = start
+    while offset <= end:
+        chunk = await run_sync(_read, path, offset, min(DOWNLOAD_CHUNK_SIZE, end - offset + 1))
+        if not chunk:
+            return
+        yield chunk
+        offset += len(chunk)
@@ -0,0 +1,137 @@
+import asyncio
+from functools import partial
+from typing import Callable
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from src.config import BULK_CONCURRENCY, BULK_MAX_RETRIES
+from src.drive import cache, upstream
+from src.drive.service import get_service
+
+# Drive accepts at most 100 sub-requests in one multipart batch.
+BATCH_SIZE = 100
+
+
+async def _execute_batch_once(service, requests: dict[str, Callable[[], HttpRequest]]) -> dict[str, tuple]:
+    outcomes = {}
+
+    def callback(request_id, response, exception):
+        outcomes[request_id] = (response, exception)
+
+    batch = service.new_batch_http_request(callback=callback)
+    user = None
+    for request_id, request_factory in requests.items():
+        request = request_factory()
+        user = upstream.user_of(request.http)
+        batch.add(request, request_id=request_id)
+    try:
+        # Every sub-request counts against the user's quota; failed ones are retried by execute_batch.
+        await upstream.call(batch.execute, user=user, retries=0, cost=len(requests))
+    except (HttpError, OSError, httplib2.HttpLib2Error, upstream.UpstreamUnavailable) as error:
+        return {request_id: (None, error) for request_id in requests}
+    if any(upstream.is_rate_limited(error) for _, error in outcomes.values()):
+        upstream.bucket(user).slow_down()
+    return outcomes
+
+
+async def execute_batch(service, requests: dict[str, Callable[[], HttpRequest]]) -> dict[str, dict | Exception]:
+    results = {}
+    pending = dict(requests)
+    attempt = 0
+    while pending:
+        outcomes = await _execute_batch_once(service, pending)
+        retry, delay = {}, 0
+        attempt += 1
+        for request_id, request_factory in pending.items():
+            response, error = outcomes.get(request_id, (None, RuntimeError('No response in batch')))
+            if error is not None and upstream.is_retryable(error) and attempt <= BULK_MAX_RETRIES:
+                retry[request_id] = request_factory
+                delay = max(delay, upstream.backoff(attempt, error))
+            else:
+                results[request_id] = error if error is not None else (response or {})
+        pending = retry
+        if pending:
+            await asyncio.sleep(delay)
+    return results
+
+
+def _operation_request(service, operation: str, file_id: str, new_folder_id: str | None, parents: list[str]):
+    files = service.files()
+    if operation == 'trash':
+        return files.update(fileId=file_id, body={'trashed': True}, fields='id, parents')
+    if operation == 'restore':
+        return files.update(fileId=file_id, body={'trashed': False}, fields='id, parents')
+    if operation == 'delete':
+        return files.delete(fileId=file_id)
+    return files.update(
+        fileId=file_id, addParents=new_folder_id, removeParents=','.join(parents), fields='id, parents',
+    )
+
+
+async def _run_chunk(service, operation: str, file_ids: list[str], new_folder_id: str | None) -> dict:
+    results, parents = {}, {}
+    if operation == 'move':
+        # One batch reads every current parent, instead of a get per file before each update.
+        fetched = await execute_batch(
+            service,
+            {file_id: partial(service.files().get, fileId=file_id, fields='parents') for file_id in file_ids},
+        )
+        for file_id, result in fetched.items():
+            if isinstance(result, Exception):
+                results[file_id] = result
+            else:
+                parents[file_id] = result.get('parents', [])
+        file_ids = list(parents)
+
+    requests = {
+        file_id: partial(_operation_request, service, operation, file_id, new_folder_id, parents.get(file_id, []))
+        for file_id in file_ids
+    }
+    for file_id, result in (await execute_batch(service, requests)).items():
+        if not isinstance(result, Exception):
+            parents[file_id] = parents.get(file_id, []) + result.get('parents', [])
+        results[file_id] = result
+    return {file_id: (result, parents.get(file_id, [])) for file_id, result in results.items()}
+
+
+async def bulk_operation(
+        credentials: Credentials | None, operation: str, file_ids: list[str], new_folder_id: str | None = None,
+        user_key: str | None = None, progress=None,
+) -> list[dict]:
+    service = get_service(credentials)
+    file_ids = list(dict.fromkeys(file_ids))
+    slots = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def run_chunk(chunk):
+        async with slots:
+            outcomes = await _run_chunk(service, operation, chunk, new_folder_id)
+        if progress:
+            await progress(len(chunk))
+        return outcomes
+
+    outcomes = {}
+    chunks = [file_ids[i:i + BATCH_SIZE] for i in range(0, len(file_ids), BATCH_SIZE)]
+    for chunk_outcomes in await asyncio.gather(*(run_chunk(chunk) for chunk in chunks)):
+        outcomes.update(chunk_outcomes)
+
+    folder_ids = {new_folder_id} if new_folder_id else set()
+    for _, parents in outcomes.values():
+        folder_ids.update(parents)
+    await cache.invalidate(user_key, file_ids, folder_ids)
+
+    report = []
+    for file_id in file_ids:
+        result, _ = outcomes[file_id]
+        if isinstance(result, Exception):
+            report.append({'id': file_id, 'status': 'error', 'error': f'An error occurred: {result}'})
+        else:
+            report.append({'id': file_id, 'status': 'ok'})
+    return report
+
+
+def summary(report: list[dict]) -> dict:
+    failed = sum(item['status'] == 'error' for item in report)
+    return {'succeeded': len(report) - failed, 'failed': failed, 'results': report}
@@ -0,0 +1,164 @@
+import json
+from typing import Iterable
+
+from src.config import (
+    CACHE_LISTING_TTL, CACHE_METADATA_TTL, CACHE_TRASH_TTL, CHANGES_POLL_INTERVAL, PREFETCH_ENABLED,
+)
+from src.drive.upstream import execute
+from src.redis_client import redis
+
+KEY_PREFIX = 'drive-cache'
+STATS_KEY = f'{KEY_PREFIX}:stats'
+CHANGES_TOKEN_TTL = 7 * 24 * 60 * 60
+
+# Every kind is a Redis hash per item, so all pages of one listing are dropped together.
+TTLS = {
+    'listing': CACHE_LISTING_TTL,
+    'file': CACHE_METADATA_TTL,
+    'trash': CACHE_TRASH_TTL,
+}
+
+# Reads an item and counts the hit or miss in one round trip. With prefetching on, the first read of a
+# prefetched item also claims its marker; only a claim that finds the item still cached is a prefetch hit.
+GET_SCRIPT = '''
+local value = redis.call('HGET', KEYS[1], ARGV[1])
+redis.call('HINCRBY', KEYS[2], ARGV[2] .. (value and ':hits' or ':misses'), 1)
+if ARGV[3] ~= '' and redis.call('SREM', KEYS[3], ARGV[3]) == 1 and value then
+    redis.call('HINCRBY', KEYS[2], 'prefetch:hits', 1)
+end
+return value
+'''
+
+
+def _key(user_key: str, kind: str, item_id: str) -> str:
+    return f'{KEY_PREFIX}:{user_key}:{kind}:{item_id}'
+
+
+def _keys_key(user_key: str) -> str:
+    # Every cache key of a user, so clear() does not have to scan the keyspace.
+    return f'{KEY_PREFIX}:{user_key}:keys'
+
+
+def _prefetched_key(user_key: str) -> str:
+    return f'{KEY_PREFIX}:{user_key}:prefetched'
+
+
+async def get(user_key: str, kind: str, item_id: str, field: str = ''):
+    value = await redis.eval(
+        GET_SCRIPT, 3, _key(user_key, kind, item_id), STATS_KEY, _prefetched_key(user_key),
+        field, kind, f'{kind}:{item_id}' if PREFETCH_ENABLED else '',
+    )
+    return None if value is None else json.loads(value)
+
+
+async def contains(user_key: str, kind: str, item_id: str, field: str = '') -> bool:
+    return bool(await redis.hexists(_key(user_key, kind, item_id), field))
+
+
+async def mark_prefetched(user_key: str, kind: str, item_id: str):
+    key = _prefetched_key(user_key)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.sadd(key, f'{kind}:{item_id}')
+        pipe.hincrby(STATS_KEY, 'prefetch:requests', 1)
+        pipe.expire(key, max(TTLS.values()))
+        await pipe.execute()
+
+
+async def put(user_key: str, kind: str, item_id: str, value, field: str = ''):
+    key, keys_key = _key(user_key, kind, item_id), _keys_key(user_key)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hset(key, field, json.dumps(value))
+        pipe.expire(key, TTLS[kind])
+        pipe.sadd(keys_key, key)
+        pipe.expire(keys_key, max(TTLS.values()))
+        await pipe.execute()
+
+
+async def invalidate(user_key: str | None, file_ids: Iterable[str] = (), folder_ids: Iterable[str] = ()):
+    if not user_key:
+        return
+    file_ids, folder_ids = list(file_ids), set(folder_ids)
+    # Cached metadata still knows the old parents of moved, trashed or deleted files.
+    async with redis.pipeline(transaction=False) as pipe:
+        for file_id in file_ids:
+            pipe.hget(_key(user_key, 'file', file_id), '')
+        for metadata in await pipe.execute():
+            if metadata is not None:
+                folder_ids.update(json.loads(metadata).get('parents', []))
+    keys = [_key(user_key, 'trash', 'all')]
+    keys += [_key(user_key, kind, file_id) for file_id in file_ids for kind in ('file', 'listing')]
+    keys += [_key(user_key, 'listing', folder_id) for folder_id in folder_ids if folder_id]
+    await redis.delete(*keys)
+
+
+async def clear(user_key: str):
+    # Only what put() stored: the changes poll and token keys are not part of the cache.
+    keys_key = _keys_key(user_key)
+    await redis.delete(keys_key, _prefetched_key(user_key), *await redis.smembers(keys_key))
+
+
+async def sync_changes(user_key: str | None, service):
+    if not user_key:
+        return
+    if not await redis.set(f'{KEY_PREFIX}:{user_key}:changes-poll', 1, nx=True, ex=CHANGES_POLL_INTERVAL):
+        return
+    token_key = f'{KEY_PREFIX}:{user_key}:changes-token'
+    page_token = await redis.get(token_key)
+    if page_token is None:
+        # Without a page token nothing cached for this user can be trusted.
+        await clear(user_key)
+        response = await execute(service.changes().getStartPageToken())
+        await redis.set(token_key, response['startPageToken'], ex=CHANGES_TOKEN_TTL)
+        return
+
+    file_ids, folder_ids = [], []
+    new_start_page_token = None
+    while page_token:
+        response = await execute(
+            service.changes().list(
+                pageToken=page_token,
+                pageSize=1000,
+                spaces='drive',
+                fields='nextPageToken, newStartPageToken, changes(fileId, file(parents))',
+            ),
+        )
+        for change in response.get('changes', []):
+            file_ids.append(change['fileId'])
+            folder_ids.extend(change.get('file', {}).get('parents', []))
+        page_token = response.get('nextPageToken')
+        new_start_page_token = response.get('newStartPageToken', new_start_page_token)
+    if file_ids:
+        await invalidate(user_key, file_ids, folder_ids)
+    if new_start_page_token is not None:
+        await redis.set(token_key, new_start_page_token, ex=CHANGES_TOKEN_TTL)
+
+
+async def drive_user_id(user_key: str, service) -> str:
+    key = f'{KEY_PREFIX}:{user_key}:user-id'
+    user_id = await redis.get(key)
+    if user_id is None:
+        response = await execute(service.about().get(fields='user(permissionId)'))
+        user_id = response['user']['permissionId']
+        await redis.set(key, user_id, ex=CHANGES_TOKEN_TTL)
+    return user_id
+
+
+async def stats() -> dict:
+    counters = await redis.hgetall(STATS_KEY)
+    result = {}
+    for kind in TTLS:
+        hits, misses = int(counters.get(f'{kind}:hits', 0)), int(counters.get(f'{kind}:misses', 0))
+        result[kind] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+    # Every prefetched item costs one Drive call; the ones never read before expiry or invalidation were wasted.
+    requests, hits = int(counters.get('prefetch:requests', 0)), int(counters.get('prefetch:hits', 0))
+    result['prefetch'] = {
+        'requests': requests,
+        'hits': hits,
+        'wasted': requests - hits,
+        'hit_rate': round(hits / requests, 4) if requests else None,
+    }
+    return result
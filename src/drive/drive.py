@@ -1,226 +1,413 @@
-import io
-from typing import List
+import asyncio
+import logging
+import weakref
+from functools import partial
+from typing import List, NamedTuple
 
+import httplib2
 from fastapi import UploadFile
 from google.auth import exceptions as google_exeptions
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
+from googleapiclient.http import MediaIoBaseUpload
 
+from src.config import DOWNLOAD_CHUNK_SIZE, PAGE_SIZE, UPLOAD_CHUNK_SIZE, UPLOAD_CONCURRENCY, UPLOAD_MAX_RETRIES
+from src.drive import cache, upstream
+from src.drive.models import FIELD_MASKS, FOLDER_MIME_TYPE, listing_fields
+from src.drive.service import get_service
+from src.drive.upstream import coalesce, execute
 
-def get_service(credentials):
-    return build('drive', 'v3', credentials=credentials)
+FILE_METADATA_FIELDS = FIELD_MASKS['download']
+LISTING_FIELDS = listing_fields('browse')
+# Failures an upload reports per file instead of failing the whole request.
+UPLOAD_ERRORS = (HttpError, OSError, httplib2.HttpLib2Error, upstream.UpstreamUnavailable)
 
 
-def download_file_by_id(file_id: str, service):
-    request = service.files().get_media(fileId=file_id)
-    file = io.BytesIO()
-    downloader = MediaIoBaseDownload(file, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-        print(f'Download {int(status.progress() * 100)}%')
-    return file.getvalue()
+class Page(NamedTuple):
+    files: list[dict]
+    next_cursor: str | None
+    indexed_at: str | None = None
 
 
-async def folders_and_files(credentials: Credentials | None, file_id: str | None = None):
+logger = logging.getLogger(__name__)
+
+_upload_slots: weakref.WeakValueDictionary[str | None, asyncio.Semaphore] = weakref.WeakValueDictionary()
+
+
+def _get_range(request, headers: dict):
+    response, content = request.http.request(request.uri, method='GET', headers=headers)
+    if response.status >= 300 and response.status != 416:
+        raise HttpError(response, content, uri=request.uri)
+    return response, content
+
+
+async def iter_media(request, start: int = 0, end: int | None = None, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+    offset = start
+    while end is None or offset <= end:
+        chunk_end = offset + chunk_size - 1 if end is None else min(offset + chunk_size - 1, end)
+        headers = dict(request.headers, range=f'bytes={offset}-{chunk_end}')
+        response, content = await upstream.call(_get_range, request, headers, user=upstream.user_of(request.http))
+        if response.status == 416:
+            return
+        if response.status == 200:
+            # The server ignored the Range header and sent the whole body.
+            yield content[offset:] if end is None else content[offset:end + 1]
+            return
+        if not content:
+            return
+        yield content
+        offset += len(content)
+        total = response.get('content-range', '').rpartition('/')[2]
+        if total.isdigit() and offset >= int(total):
+            return
+
+
+async def iter_file_content(credentials: Credentials | None, file_id: str, start: int = 0, end: int | None = None):
+    service = get_service(credentials)
+    async for chunk in iter_media(service.files().get_media(fileId=file_id), start, end):
+        yield chunk
+
+
+async def _fetch_file_metadata(service, file_id: str, user_key: str | None = None):
+    file = await execute(service.files().get(fileId=file_id, fields=FILE_METADATA_FIELDS))
+    if user_key and file:
+        await cache.put(user_key, 'file', file_id, file)
+    return file
+
+
+async def fill_file_metadata(service, file_id: str, user_key: str):
+    # Concurrent fills of the same file share one Drive call.
+    return await coalesce(('file', user_key, file_id), partial(_fetch_file_metadata, service, file_id, user_key))
+
+
+async def cached_file_metadata(service, file_id: str, user_key: str | None = None):
+    if not user_key:
+        return await _fetch_file_metadata(service, file_id)
+    file = await cache.get(user_key, 'file', file_id)
+    if file is not None:
+        return file
+    return await fill_file_metadata(service, file_id, user_key)
+
+
+async def list_page(
+        service, query: str, cursor: str | None = None, page_size: int = PAGE_SIZE, fields: str = LISTING_FIELDS,
+        **kwargs,
+) -> Page:
+    response = await execute(
+        service.files().list(q=query, pageToken=cursor, pageSize=min(page_size, PAGE_SIZE), fields=fields, **kwargs),
+    )
+    return Page(response.get('files', []), response.get('nextPageToken'))
+
+
+async def iter_pages(service, query: str, page_size: int = PAGE_SIZE, fields: str = LISTING_FIELDS, **kwargs):
+    cursor = None
+    while True:
+        page = await list_page(service, query, cursor, page_size, fields, **kwargs)
+        yield page.files
+        cursor = page.next_cursor
+        if not cursor:
+            return
+
+
+async def iter_files(service, query: str, page_size: int = PAGE_SIZE, fields: str = LISTING_FIELDS, **kwargs):
+    async for files in iter_pages(service, query, page_size, fields, **kwargs):
+        for file in files:
+            yield file
+
+
+def page_field(cursor: str | None, page_size: int) -> str:
+    return f'{cursor or ""}:{page_size}'
+
+
+async def fill_page(
+        service, query: str, user_key: str, kind: str, item_id: str, cursor: str | None = None,
+        page_size: int = PAGE_SIZE, fields: str = LISTING_FIELDS,
+) -> Page:
+    field = page_field(cursor, page_size)
+
+    async def fetch():
+        fetched = await list_page(service, query, cursor, page_size, fields)
+        await cache.put(user_key, kind, item_id, fetched, field)
+        return fetched
+    return await coalesce(('page', user_key, kind, item_id, field), fetch)
+
+
+async def cached_page(
+        service, query: str, user_key: str | None, kind: str, item_id: str, cursor: str | None = None,
+        page_size: int = PAGE_SIZE, fields: str = LISTING_FIELDS,
+) -> Page:
+    if not user_key:
+        return await list_page(service, query, cursor, page_size, fields)
+    page = await cache.get(user_key, kind, item_id, page_field(cursor, page_size))
+    if page is not None:
+        return Page(*page)
+    return await fill_page(service, query, user_key, kind, item_id, cursor, page_size, fields)
+
+
+def folder_query(folder_id: str) -> str:
+    return f'"{folder_id}" in parents and trashed=false'
+
+
+async def cached_folder_listing(
+        service, folder_id: str, user_key: str | None = None, cursor: str | None = None, page_size: int = PAGE_SIZE,
+) -> Page:
+    return await cached_page(service, folder_query(folder_id), user_key, 'listing', folder_id, cursor, page_size)
+
+
+async def get_file_metadata(credentials: Credentials | None, file_id: str, user_key: str | None = None):
+    service = get_service(credentials)
+    await cache.sync_changes(user_key, service)
+    return await cached_file_metadata(service, file_id, user_key)
+
+
+async def folders_and_files(
+        credentials: Credentials | None, file_id: str | None = None, user_key: str | None = None,
+        cursor: str | None = None, page_size: int = PAGE_SIZE,
+):
     service = get_service(credentials)
     if not file_id:
         try:
-            root_folder = service.files().get(fileId='root').execute()
-            root_folder_files = service.files().list(
-                q=f'"{root_folder["id"]}" in parents and trashed=false',
-                fields='nextPageToken, files(id, name, mimeType, parents, size)',
-            ).execute()
-            return root_folder_files.get('files', [])
+            await cache.sync_changes(user_key, service)
+            root_folder = await cached_file_metadata(service, 'root', user_key)
+            return await cached_folder_listing(service, root_folder['id'], user_key, cursor, page_size)
         except google_exeptions.RefreshError:
             return False
 
-    file = service.files().get(fileId=file_id).execute()
+    await cache.sync_changes(user_key, service)
+    file = await cached_file_metadata(service, file_id, user_key)
     if not file:
         return None
-    if file['mimeType'] == 'application/vnd.google-apps.folder':
-        folder_files = service.files().list(
-            q=f'"{file["id"]}" in parents and trashed=false',
-            fields='nextPageToken, files(id, name, mimeType, parents, size)',
-        ).execute()
-        return folder_files.get('files', [])
+    if file['mimeType'] == FOLDER_MIME_TYPE:
+        return await cached_folder_listing(service, file['id'], user_key, cursor, page_size)
     else:
-        return download_file_by_id(file_id, service)
+        return file
 
 
-async def search_file(credentials: Credentials | None, file_name=None, folder_name=None, page_size: int = 10):
+async def search_file(
+        credentials: Credentials | None, file_name=None, folder_name=None, page_size: int = 10,
+        cursor: str | None = None, mode: str = 'exact', mime_type: str | None = None, min_size: int | None = None,
+        max_size: int | None = None,
+) -> Page:
     service = get_service(credentials)
-    files = []
+    conditions = ['trashed=false']
     if file_name:
-        query = f'name = "{file_name}" and trashed=false'
-    elif folder_name:
-        query = f'"{folder_name}" in parents and trashed=false'
-    elif file_name and folder_name:
-        query = f'"{folder_name}" in parents and name = "{file_name}" and trashed=false'
-    else:
-        query = "mimeType='application/vnd.google-apps.folder'"
-    response = (
-        service.files()
-        .list(
-            pageSize=page_size,
-            q=query,
-            spaces='drive',
-            fields='nextPageToken, files(id, name, mimeType, parents, size)',
-        )
-        .execute()
+        # Drive's "contains" matches name prefixes, the closest live equivalent of prefix and substring search.
+        operator = '=' if mode == 'exact' else 'contains'
+        conditions.append(f'name {operator} "{file_name}"')
+    if folder_name:
+        conditions.append(f'"{folder_name}" in parents')
+    if mime_type:
+        conditions.append(f'mimeType = "{mime_type}"')
+    if len(conditions) == 1:
+        conditions.append("mimeType='application/vnd.google-apps.folder'")
+    page = await list_page(
+        service, ' and '.join(conditions), cursor, page_size, listing_fields('search'), spaces='drive',
     )
-    files.extend(response.get('files', []))
-
-    return files
-
-
-async def create_folder(credentials: Credentials | None, folder_name: str, parent_folder_id: str = None):
+    if min_size is None and max_size is None:
+        return page
+    # Drive's query language has no size terms, so the page is filtered here the way the index filters: files
+    # without a size never match. A filtered page can be shorter than page_size; its cursor still continues.
+    files = [
+        file for file in page.files if 'size' in file
+        and (min_size is None or int(file['size']) >= min_size) and (max_size is None or int(file['size']) <= max_size)
+    ]
+    return page._replace(files=files)
+
+
+async def make_folder(service, folder_name: str, parent_folder_id: str, user_key: str | None = None) -> dict:
+    file_metadata = {
+        'name': folder_name,
+        'mimeType': 'application/vnd.google-apps.folder',
+        'parents': [parent_folder_id],
+    }
+    file = await execute(service.files().create(body=file_metadata, fields='id, parents'))
+    await cache.invalidate(user_key, folder_ids=file.get('parents', []))
+    return file
+
+
+async def create_folder(
+        credentials: Credentials | None, folder_name: str, parent_folder_id: str = None, user_key: str | None = None,
+):
     try:
         service = get_service(credentials)
         if not parent_folder_id or parent_folder_id == 'null':
-            root_folder = service.files().get(fileId='root').execute()
+            root_folder = await execute(service.files().get(fileId='root', fields='id'))
             parent_folder_id = root_folder.get('id')
-        file_metadata = {
-            'name': folder_name,
-            'mimeType': 'application/vnd.google-apps.folder',
-            'parents': [parent_folder_id],
-        }
-        file = service.files().create(body=file_metadata, fields='id, parents').execute()
+        file = await make_folder(service, folder_name, parent_folder_id, user_key)
         return file.get('parents', [])
     except HttpError as error:
         return f'An error occurred: {error}'
 
 
-async def move_file(credentials: Credentials | None, file_id: str, new_folder_id: str):
+async def move_file(
+        credentials: Credentials | None, file_id: str, new_folder_id: str, user_key: str | None = None,
+):
     try:
         service = get_service(credentials)
-        file = service.files().get(fileId=file_id, fields='parents').execute()
+        file = await execute(service.files().get(fileId=file_id, fields='parents'))
         previous_parents = ','.join(file.get('parents'))
-        file = service.files().update(
-            fileId=file_id,
-            addParents=new_folder_id,
-            removeParents=previous_parents,
-            fields='id, parents',
-        ).execute()
+        file = await execute(
+            service.files().update(
+                fileId=file_id,
+                addParents=new_folder_id,
+                removeParents=previous_parents,
+                fields='id, parents',
+            ),
+        )
+        await cache.invalidate(user_key, [file_id], file.get('parents', []) + previous_parents.split(','))
         return bool(file)
     except HttpError as error:
         return f'An error occurred: {error}'
 
 
-async def move_to_trash(credentials: Credentials | None, file_id: str):
+async def move_to_trash(credentials: Credentials | None, file_id: str, user_key: str | None = None):
     try:
         service = get_service(credentials)
         body_value = {'trashed': True}
-        file = service.files().update(fileId=file_id, body=body_value).execute()
+        file = await execute(service.files().update(fileId=file_id, body=body_value, fields='id, parents'))
+        await cache.invalidate(user_key, [file_id], file.get('parents', []))
         return bool(file)
     except HttpError as error:
         return f'An error occurred: {error}'
 
 
-async def recover_from_trash(credentials: Credentials | None, file_id: str):
+async def recover_from_trash(credentials: Credentials | None, file_id: str, user_key: str | None = None):
     try:
         service = get_service(credentials)
         body_value = {'trashed': False}
-        file = service.files().update(fileId=file_id, body=body_value).execute()
+        file = await execute(service.files().update(fileId=file_id, body=body_value, fields='id, parents'))
+        await cache.invalidate(user_key, [file_id], file.get('parents', []))
         return bool(file)
     except HttpError as error:
         return f'An error occurred: {error}'
 
 
-async def empty_trash(credentials: Credentials | None):
+async def empty_trash(credentials: Credentials | None, user_key: str | None = None):
     try:
         service = get_service(credentials)
-        result = service.files().emptyTrash().execute()
+        result = await execute(service.files().emptyTrash())
+        await cache.invalidate(user_key)
         return bool(result)
     except HttpError as error:
         return f'An error occurred: {error}'
 
 
-async def list_files_in_trash(credentials: Credentials | None):
+async def list_files_in_trash(
+        credentials: Credentials | None, user_key: str | None = None, cursor: str | None = None,
+        page_size: int = PAGE_SIZE,
+):
     try:
         service = get_service(credentials)
-        files = service.files().list(q='trashed=true', fields='files(id, name, mimeType, parents, size)').execute()
-        return files.get('files', [])
+        await cache.sync_changes(user_key, service)
+        return await cached_page(
+            service, 'trashed=true', user_key, 'trash', 'all', cursor, page_size, listing_fields('trash'),
+        )
     except HttpError as error:
         return f'An error occurred: {error}'
 
 
-async def delete_file(credentials: Credentials, file_id: str):
+async def delete_file(credentials: Credentials, file_id: str, user_key: str | None = None):
     try:
         service = get_service(credentials)
-        result = service.files().delete(fileId=file_id).execute()
+        parents = []
+        if user_key:
+            file = await execute(service.files().get(fileId=file_id, fields='parents'))
+            parents = file.get('parents', [])
+        result = await execute(service.files().delete(fileId=file_id))
+        await cache.invalidate(user_key, [file_id], parents)
         return bool(result)
     except HttpError as error:
         return f'An error occurred: {error}'
 
 
-async def upload_files(credentials: Credentials | None, files: List[UploadFile], folder_id: str | None = None):
-    try:
-        service = get_service(credentials)
-        for file in files:
-            file_metadata = {'name': file.filename}
-            if folder_id or not folder_id == 'null':
-                file_metadata['parents'] = [folder_id]
-            fh = io.BytesIO(file.file.read())
-            media = MediaIoBaseUpload(fh, mimetype=file.content_type)
-            file = (
+def upload_slots(credentials: Credentials | None) -> asyncio.Semaphore:
+    key = credentials.token if credentials else None
+    semaphore = _upload_slots.get(key)
+    if semaphore is None:
+        semaphore = _upload_slots[key] = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    return semaphore
+
+
+def streaming_media(file: UploadFile) -> MediaIoBaseUpload:
+    file.file.seek(0)
+    return MediaIoBaseUpload(
+        file.file,
+        mimetype=file.content_type or 'application/octet-stream',
+        chunksize=UPLOAD_CHUNK_SIZE,
+        resumable=True,
+    )
+
+
+async def upload_media(request, progress=None):
+    response, sent = None, 0
+    user = upstream.user_of(request.http)
+    while response is None:
+        # A retried chunk keeps its resumable session URI and asks Drive for the committed offset first.
+        upload_status, response = await upstream.call(request.next_chunk, user=user, retries=UPLOAD_MAX_RETRIES)
+        if progress:
+            committed = upload_status.resumable_progress if upload_status else request.resumable.size()
+            await progress(committed - sent)
+            sent = committed
+    return response
+
+
+async def upload_file(
+        credentials: Credentials | None, service, file: UploadFile, folder_id: str | None = None,
+        user_key: str | None = None, progress=None,
+):
+    file_metadata = {'name': file.filename}
+    if folder_id and folder_id != 'null':
+        file_metadata['parents'] = [folder_id]
+    async with upload_slots(credentials):
+        try:
+            result = await upload_media(
                 service.files()
-                .create(body=file_metadata, media_body=media, fields='id, parents')
-                .execute()
+                .create(body=file_metadata, media_body=streaming_media(file), fields='id, parents'),
+                progress,
             )
-            return file.get('parents', [])
-    except HttpError as error:
-        return f'An error occurred: {error}'
+        except UPLOAD_ERRORS as error:
+            return {'name': file.filename, 'error': f'An error occurred: {error}'}
+    await cache.invalidate(user_key, folder_ids=result.get('parents', []))
+    return {'name': file.filename, 'id': result['id'], 'parents': result.get('parents', [])}
+
+
+async def upload_files(
+        credentials: Credentials | None, files: List[UploadFile], folder_id: str | None = None,
+        user_key: str | None = None,
+):
+    service = get_service(credentials)
+    return list(
+        await asyncio.gather(*(upload_file(credentials, service, file, folder_id, user_key) for file in files)),
+    )
 
 
-async def update_file(credentials: Credentials | None, file_to_replace: UploadFile, file_id: str):
+async def update_file(
+        credentials: Credentials | None, file_to_replace: UploadFile, file_id: str, user_key: str | None = None,
+):
     try:
         service = get_service(credentials)
-        fh = io.BytesIO(file_to_replace.file.read())
-        media = MediaIoBaseUpload(fh, mimetype=file_to_replace.content_type, resumable=True)
-        result = (
-            service.files()
-            .update(fileId=file_id, body={}, media_body=media, fields='id')
-            .execute()
-        )
+        async with upload_slots(credentials):
+            result = await upload_media(
+                service.files()
+                .update(fileId=file_id, body={}, media_body=streaming_media(file_to_replace), fields='id'),
+            )
+        await cache.invalidate(user_key, [file_id])
         return bool(result)
-    except HttpError as err:
+    except UPLOAD_ERRORS as err:
         return f'An error occurred: {err}'
 
 
-async def download_file(credentials: Credentials | None, file_id=None, file_name=None):
+async def download_file(credentials: Credentials | None, file_id=None, file_name=None, user_key: str | None = None):
     if file_id:
-        service = get_service(credentials)
-        return download_file_by_id(file_id, service)
+        return await get_file_metadata(credentials, file_id, user_key)
     elif file_name:
-        files = await search_file(credentials=credentials, file_name=file_name)
+        files = (await search_file(credentials=credentials, file_name=file_name)).files
         if len(files) == 0:
-            print(f"Couldn't find file: {file_name}")
+            logger.info("Couldn't find file %s", file_name)
+            return
         elif len(files) > 1:
-            print(f'Multiple files found: {len(files)}')
+            logger.info('Multiple files found for %s: %d', file_name, len(files))
             return
-        file_id = files[0]['id']
-        return download_file(file_id)
+        return await get_file_metadata(credentials, files[0]['id'], user_key)
     else:
         return False
-
-
-async def export_file(credentials: Credentials | None, file_id):
-    try:
-        service = get_service(credentials)
-        request = service.files().export_media(
-            fileId=file_id, mimeType='application/pdf',
-        )
-        file = io.BytesIO()
-        downloader = MediaIoBaseDownload(file, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-            print(f'Download {int(status.progress() * 100)}.')
-
-    except HttpError as error:
-        return f'An error occurred: {error}'
-
-    return file.getvalue()
@@ -0,0 +1,143 @@
+import itertools
+from collections import defaultdict
+from pathlib import Path
+
+from google.oauth2.credentials import Credentials
+
+from src.config import SEARCH_INDEX_ENABLED
+from src.drive import bulk, cache, drive, search_index, walker
+from src.drive.executor import run_sync
+from src.drive.models import FOLDER_MIME_TYPE, listing_fields
+from src.drive.service import get_service
+
+DUPLICATES_FIELDS = listing_fields('duplicates')
+
+# Files are scoped to a folder tree by walking the parent column; UNION also stops at cycles.
+TREE = '''
+tree (id) AS (
+    SELECT :root
+    UNION
+    SELECT files.id FROM files JOIN tree ON files.parent = tree.id
+),
+scoped AS (SELECT * FROM files WHERE id IN tree),
+'''
+# Only binary files have an md5Checksum; equal checksum and size are treated as equal content.
+GROUPS = '''
+duplicate_groups AS (
+    SELECT md5_checksum, size, COUNT(*) AS copies, size * (COUNT(*) - 1) AS reclaimable
+    FROM {scope}
+    WHERE md5_checksum IS NOT NULL AND size >= :min_size
+    GROUP BY md5_checksum, size
+    HAVING COUNT(*) > 1
+)
+'''
+TOTALS = '''
+SELECT COUNT(*) AS groups, COALESCE(SUM(copies - 1), 0) AS extra_copies,
+    COALESCE(SUM(reclaimable), 0) AS reclaimable_bytes
+FROM duplicate_groups
+'''
+COPIES = '''
+, top AS (SELECT * FROM duplicate_groups ORDER BY reclaimable DESC, md5_checksum LIMIT :limit)
+SELECT top.copies, top.reclaimable, {scope}.*
+FROM top JOIN {scope} USING (md5_checksum, size)
+ORDER BY top.reclaimable DESC, top.md5_checksum, {scope}.modified_time, {scope}.id
+'''
+
+
+def _copy(row) -> dict:
+    return {'id': row['id'], 'name': row['name'], 'parent': row['parent'], 'modified_time': row['modified_time']}
+
+
+def _find(path: Path, root: str | None, min_size: int, limit: int) -> tuple[dict, list[dict]]:
+    scope = 'scoped' if root else 'files'
+    with_clause = f'WITH RECURSIVE {TREE if root else ""}{GROUPS.format(scope=scope)}'
+    params = {'root': root, 'min_size': min_size, 'limit': limit}
+    with search_index.connect(path) as connection:
+        totals = dict(connection.execute(with_clause + TOTALS, params).fetchone())
+        rows = connection.execute(with_clause + COPIES.format(scope=scope), params).fetchall()
+    duplicates = []
+    for (md5_checksum, size), copies in itertools.groupby(rows, lambda row: (row['md5_checksum'], row['size'])):
+        # The oldest copy is kept; the others are what trashing would remove.
+        keep, *extra = copies
+        duplicates.append({
+            'md5_checksum': md5_checksum, 'size': size, 'copies': keep['copies'],
+            'reclaimable_bytes': keep['reclaimable'], 'keep': _copy(keep), 'extra': [_copy(row) for row in extra],
+        })
+    return totals, duplicates
+
+
+async def _walk(service, root: str, user_key: str, min_size: int, limit: int) -> tuple[dict, list[dict], dict]:
+    # Without the index the folder tree is listed directly; the same grouping as the GROUPS and COPIES queries.
+    groups, errors = defaultdict(list), {}
+    async for folder_id, files in walker.walk(service, root, user_key, fields=DUPLICATES_FIELDS):
+        if isinstance(files, Exception):
+            errors[folder_id] = f'An error occurred: {files}'
+            continue
+        for file in files:
+            size = int(file.get('size', -1))
+            if file['mimeType'] != FOLDER_MIME_TYPE and file.get('md5Checksum') and size >= min_size:
+                groups[file['md5Checksum'], size].append({
+                    'id': file['id'], 'name': file['name'], 'parent': folder_id,
+                    'modified_time': file.get('modifiedTime'),
+                })
+    found = [(md5_checksum, size, copies) for (md5_checksum, size), copies in groups.items() if len(copies) > 1]
+    totals = {
+        'groups': len(found), 'extra_copies': sum(len(copies) - 1 for _, _, copies in found),
+        'reclaimable_bytes': sum(size * (len(copies) - 1) for _, size, copies in found),
+    }
+    found.sort(key=lambda group: (-group[1] * (len(group[2]) - 1), group[0]))
+    duplicates = []
+    for md5_checksum, size, copies in found[:limit]:
+        keep, *extra = sorted(copies, key=lambda copy: (copy['modified_time'] or '', copy['id']))
+        duplicates.append({
+            'md5_checksum': md5_checksum, 'size': size, 'copies': len(copies),
+            'reclaimable_bytes': size * len(extra), 'keep': keep, 'extra': extra,
+        })
+    return totals, duplicates, errors
+
+
+async def _built_index(service, user_key: str) -> str | None:
+    # The user id of a search index that can answer right away; None when the index is off or still cold.
+    if not SEARCH_INDEX_ENABLED:
+        return None
+    user_id = await cache.drive_user_id(user_key, service)
+    return user_id if await run_sync(search_index.index_path(user_id).exists) else None
+
+
+async def needs_job(credentials: Credentials | None, user_key: str, folder_id: str | None) -> bool:
+    # Scanning the whole Drive without a built index lists every folder, too long to hold a request open for.
+    return not folder_id and await _built_index(get_service(credentials), user_key) is None
+
+
+async def find_duplicates(
+        credentials: Credentials | None, user_key: str, folder_id: str | None = None, min_size: int = 1,
+        limit: int = 100, trash: bool = False, progress=None,
+) -> dict:
+    # Answered from the search index when it is on: one crawl streams every listing page into it, later runs
+    # replay only changes. A folder is walked instead while the index is cold, rather than crawling the whole Drive.
+    service = get_service(credentials)
+    user_id = await _built_index(service, user_key)
+    if user_id is None and SEARCH_INDEX_ENABLED and not folder_id:
+        user_id = await cache.drive_user_id(user_key, service)
+        await search_index.wait_for_index(service, user_id)
+    if user_id:
+        indexed_at = await search_index.sync(service, user_id)
+        root = None
+        if folder_id:
+            root = (await drive.cached_file_metadata(service, folder_id, user_key))['id']
+        totals, duplicates = await run_sync(_find, search_index.index_path(user_id), root, min_size, limit)
+        result = {'indexed_at': indexed_at, **totals, 'duplicates': duplicates}
+    else:
+        await cache.sync_changes(user_key, service)
+        root = (await drive.cached_file_metadata(service, folder_id or 'root', user_key))['id']
+        totals, duplicates, errors = await _walk(service, root, user_key, min_size, limit)
+        result = {'indexed_at': None, **totals, 'duplicates': duplicates, 'errors': errors}
+    if trash:
+        file_ids = [copy['id'] for group in duplicates for copy in group['extra']]
+        if progress:
+            progress.total = len(file_ids)
+        report = await bulk.bulk_operation(credentials, 'trash', file_ids, user_key=user_key, progress=progress)
+        if user_id:
+            await search_index.remove_files(user_id, [item['id'] for item in report if item['status'] != 'error'])
+        result['trashed'] = bulk.summary(report)
+    return result
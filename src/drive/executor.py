@@ -0,0 +1,34 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from src.config import DRIVE_EXECUTOR_WORKERS, THUMBNAIL_WORKERS
+
+executor = ThreadPoolExecutor(max_workers=DRIVE_EXECUTOR_WORKERS, thread_name_prefix='drive')
+_process_pool: ProcessPoolExecutor | None = None
+
+
+async def run_sync(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+def process_pool() -> ProcessPoolExecutor:
+    # Started on first use. Workers are spawned, not forked: a fork would copy locks held by the executor threads.
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _process_pool
+
+
+async def run_in_process(func, *args):
+    # For CPU-bound work that holds the GIL; func and its arguments must be picklable.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(process_pool(), partial(func, *args))
+
+
+def shutdown():
+    executor.shutdown(wait=False, cancel_futures=True)
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,89 @@
+from pathlib import Path
+
+from fastapi import exceptions
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+from starlette import status
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+from src.config import EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES
+from src.drive import cache
+from src.drive.blob_cache import evict_lru, touch, write_through
+from src.drive.drive import cached_file_metadata, iter_media
+from src.drive.executor import run_sync
+from src.drive.file_types_mapping import EXPORT_EXTENSIONS, EXPORT_FORMATS
+from src.drive.responses import content_disposition
+from src.drive.service import get_service
+
+
+def rendition_path(file: dict, export_format: str) -> Path:
+    # Drive bumps the version on every change, so a new revision never matches an old rendition.
+    return Path(EXPORT_CACHE_DIR, file['id'], f'{export_format}.{file["version"]}')
+
+
+def _remove_stale(path: Path):
+    for stale in path.parent.glob(f'{path.name.split(".")[0]}.*'):
+        if stale != path and not stale.name.endswith('.tmp'):
+            stale.unlink(missing_ok=True)
+
+
+def _committed(path: Path):
+    _remove_stale(path)
+    evict_lru(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES, path)
+
+
+async def _prepend(first_chunk: bytes, chunks):
+    yield first_chunk
+    async for chunk in chunks:
+        yield chunk
+
+
+async def _export_target(credentials: Credentials | None, file_id: str, export_format: str, user_key: str | None):
+    service = get_service(credentials)
+    await cache.sync_changes(user_key, service)
+    try:
+        file = await cached_file_metadata(service, file_id, user_key)
+    except HttpError as error:
+        raise exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'An error occurred: {error}')
+    formats = EXPORT_FORMATS.get(file['mimeType'], {})
+    if export_format not in formats:
+        available = ', '.join(formats) or 'none'
+        raise exceptions.HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Cannot export {file["mimeType"]} to {export_format}, available formats: {available}',
+        )
+
+    return service, file, formats[export_format], rendition_path(file, export_format)
+
+
+async def render_export(
+        credentials: Credentials | None, file_id: str, export_format: str, user_key: str | None = None,
+        progress=None,
+) -> Path:
+    # Fills the rendition cache without a client attached; export_file then serves it from disk.
+    service, file, mime_type, path = await _export_target(credentials, file_id, export_format, user_key)
+    if not await run_sync(touch, path):
+        chunks = iter_media(service.files().export_media(fileId=file['id'], mimeType=mime_type))
+        async for chunk in write_through(chunks, path, on_commit=_committed):
+            if progress:
+                await progress(len(chunk))
+    return path
+
+
+async def export_file(
+        credentials: Credentials | None, file_id: str, export_format: str, user_key: str | None = None,
+) -> Response:
+    service, file, mime_type, path = await _export_target(credentials, file_id, export_format, user_key)
+    file_name = f'{file["name"]}.{EXPORT_EXTENSIONS.get(export_format, export_format)}'
+    if await run_sync(touch, path):
+        return FileResponse(path, media_type=mime_type, headers={'Content-Disposition': content_disposition(file_name)})
+
+    chunks = iter_media(service.files().export_media(fileId=file['id'], mimeType=mime_type))
+    try:
+        first_chunk = await anext(chunks, b'')
+    except HttpError as error:
+        raise exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'An error occurred: {error}')
+    return StreamingResponse(
+        write_through(_prepend(first_chunk, chunks), path, on_commit=_committed), media_type=mime_type,
+        headers={'Content-Disposition': content_disposition(file_name)},
+    )
@@ -47,3 +47,59 @@ FILE_TYPES_MAPPING = {
     'video/webm': 'WebM Video',
     'video/x-msvideo': 'AVI Video',
 }
+
+# Formats Drive can export each Google-native document type to, by format name.
+EXPORT_FORMATS = {
+    'application/vnd.google-apps.document': {
+        'pdf': 'application/pdf',
+        'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+        'odt': 'application/vnd.oasis.opendocument.text',
+        'rtf': 'application/rtf',
+        'txt': 'text/plain',
+        'html': 'application/zip',
+        'epub': 'application/epub+zip',
+        'md': 'text/markdown',
+    },
+    'application/vnd.google-apps.spreadsheet': {
+        'pdf': 'application/pdf',
+        'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'ods': 'application/vnd.oasis.opendocument.spreadsheet',
+        'csv': 'text/csv',
+        'tsv': 'text/tab-separated-values',
+        'html': 'application/zip',
+    },
+    'application/vnd.google-apps.presentation': {
+        'pdf': 'application/pdf',
+        'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+        'odp': 'application/vnd.oasis.opendocument.presentation',
+        'txt': 'text/plain',
+    },
+    'application/vnd.google-apps.drawing': {
+        'pdf': 'application/pdf',
+        'png': 'image/png',
+        'jpg': 'image/jpeg',
+        'svg': 'image/svg+xml',
+    },
+    'application/vnd.google-apps.script': {
+        'json': 'application/vnd.google-apps.script+json',
+    },
+}
+
+# File extension of an exported file, where it differs from the format name: Drive zips HTML with its images.
+EXPORT_EXTENSIONS = {
+    'html': 'zip',
+}
+
+# Default export format for Google-native documents that have no binary content of their own.
+DEFAULT_EXPORT_FORMATS = {
+    'application/vnd.google-apps.document': 'docx',
+    'application/vnd.google-apps.spreadsheet': 'xlsx',
+    'application/vnd.google-apps.presentation': 'pptx',
+    'application/vnd.google-apps.drawing': 'png',
+    'application/vnd.google-apps.script': 'json',
+}
+
+NATIVE_EXPORT_FORMATS = {
+    mime_type: (EXPORT_FORMATS[mime_type][export_format], EXPORT_EXTENSIONS.get(export_format, export_format))
+    for mime_type, export_format in DEFAULT_EXPORT_FORMATS.items()
+}
@@ -0,0 +1,38 @@
+import io
+
+from PIL import Image, ImageOps
+
+# Imported by the thumbnail worker processes, so this module keeps to Pillow and the standard library.
+MEDIA_TYPES = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+
+
+def _flatten(image: Image.Image, image_format: str) -> Image.Image:
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    if image_format == 'webp':
+        return image if image.mode in ('RGB', 'RGBA') else image.convert('RGBA' if has_alpha else 'RGB')
+    if not has_alpha:
+        return image.convert('RGB')
+    # JPEG has no alpha channel; transparent pixels would otherwise turn black.
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def thumbnail(source: bytes, size: int, image_format: str, quality: int) -> bytes | None:
+    try:
+        with Image.open(io.BytesIO(source)) as image:
+            # JPEG decodes straight to 1/2, 1/4 or 1/8 scale, which skips most of the work for large photos.
+            image.draft('RGB', (size, size))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size))
+            image = _flatten(image, image_format)
+            output = io.BytesIO()
+            image.save(output, format=image_format.upper(), quality=quality)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # Not an image Pillow can read, or too large to decode safely.
+        return None
+    return output.getvalue()
@@ -0,0 +1,391 @@
+import asyncio
+import json
+import logging
+import shutil
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import urlencode
+
+from fastapi import UploadFile, exceptions
+from starlette.datastructures import Headers
+
+from src.auth.credentials import get_credentials
+from src.config import (
+    JOB_KEEPALIVE_INTERVAL, JOB_LEASE_TTL, JOB_NODE, JOB_PROGRESS_INTERVAL, JOB_SPOOL_DIR, JOB_TTL, JOB_WORKERS,
+)
+from src.drive import bulk, drive, duplicates, export, sync, thumbnails
+from src.drive.executor import run_sync
+from src.drive.service import get_service
+from src.redis_client import redis
+
+KEY_PREFIX = 'jobs'
+QUEUE_KEY = f'{KEY_PREFIX}:queue'
+INSTANCES_KEY = f'{KEY_PREFIX}:instances'
+QUEUE_POLL_TIMEOUT = 1
+QUEUE_ERROR_BACKOFF = 5
+TERMINAL_STATUSES = ('succeeded', 'failed', 'cancelled')
+# Stored with the job but never sent to clients.
+PRIVATE_FIELDS = ('user_key', 'params', 'cancel_requested', 'node')
+# Their parameters are paths on the accepting node's disk, so they go to that node's queue.
+LOCAL_KINDS = ('upload', 'sync')
+# Each process has its own processing list; the node name alone would be shared by every process on the host.
+INSTANCE = f'{JOB_NODE}:{uuid.uuid4().hex[:8]}'
+
+logger = logging.getLogger(__name__)
+
+_workers: list[asyncio.Task] = []
+_running: dict[str, asyncio.Task] = {}
+
+
+class JobFailed(Exception):
+    pass
+
+
+def _key(job_id: str) -> str:
+    return f'{KEY_PREFIX}:{job_id}'
+
+
+def _channel(job_id: str) -> str:
+    return f'{KEY_PREFIX}:{job_id}:events'
+
+
+def _queue(node: str | None = None) -> str:
+    return f'{QUEUE_KEY}:{node}' if node else QUEUE_KEY
+
+
+def _processing(instance: str) -> str:
+    return f'{KEY_PREFIX}:processing:{instance}'
+
+
+def _lease(instance: str) -> str:
+    return f'{KEY_PREFIX}:lease:{instance}'
+
+
+def _public(job: dict) -> dict:
+    job = {name: value for name, value in job.items() if name not in PRIVATE_FIELDS}
+    job['eta'] = None
+    if job['status'] == 'running' and job.get('total') and job.get('done'):
+        elapsed = time.time() - job['started_at']
+        job['eta'] = round(elapsed * (job['total'] - job['done']) / job['done'], 1)
+    return job
+
+
+async def _load(job_id: str) -> dict | None:
+    state = await redis.hgetall(_key(job_id))
+    return {name: json.loads(value) for name, value in state.items()} if state else None
+
+
+async def _update(job_id: str, **fields) -> dict:
+    # Every field is JSON on its own, so progress updates never rewrite the result or the parameters.
+    key = _key(job_id)
+    fields['updated_at'] = time.time()
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hset(key, mapping={name: json.dumps(value) for name, value in fields.items()})
+        pipe.expire(key, JOB_TTL)
+        pipe.hgetall(key)
+        *_, state = await pipe.execute()
+    job = _public({name: json.loads(value) for name, value in state.items()})
+    await redis.publish(_channel(job_id), json.dumps(job))
+    return job
+
+
+async def submit(kind: str, user_key: str, params: dict, total: int | None = None, unit: str = 'items') -> dict:
+    job_id = uuid.uuid4().hex
+    node = JOB_NODE if kind in LOCAL_KINDS else None
+    job = await _update(
+        job_id, id=job_id, kind=kind, user_key=user_key, params=params, node=node, status='queued', done=0,
+        total=total, unit=unit, result=None, error=None, created_at=time.time(), started_at=None, finished_at=None,
+    )
+    await redis.lpush(_queue(node), job_id)
+    return job
+
+
+async def get(job_id: str, user_key: str | None) -> dict | None:
+    job = await _load(job_id)
+    if job is None or job['user_key'] != user_key:
+        return None
+    return _public(job)
+
+
+async def cancel(job_id: str, user_key: str | None) -> dict | None:
+    job = await _load(job_id)
+    if job is None or job['user_key'] != user_key:
+        return None
+    if job['status'] in TERMINAL_STATUSES:
+        return _public(job)
+    # A worker in another process sees the flag at its next progress report.
+    await redis.hset(_key(job_id), 'cancel_requested', 'true')
+    task = _running.get(job_id)
+    if task:
+        task.cancel()
+    if job['status'] == 'queued':
+        return await _update(job_id, status='cancelled', finished_at=time.time())
+    return _public(job)
+
+
+async def events(job_id: str, user_key: str | None):
+    # Server-sent events: the current state first, then every update until the job ends.
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(_channel(job_id))
+    try:
+        job = await get(job_id, user_key)
+        if job is None:
+            return
+        yield f'data: {json.dumps(job)}\n\n'
+        while job['status'] not in TERMINAL_STATUSES:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=JOB_KEEPALIVE_INTERVAL)
+            if message is None:
+                # Keeps proxies from closing an idle stream.
+                yield ': keepalive\n\n'
+                continue
+            job = json.loads(message['data'])
+            yield f'data: {message["data"]}\n\n'
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.close()
+
+
+class Progress:
+    # Handlers report what they finished; the job is updated at most every JOB_PROGRESS_INTERVAL seconds.
+
+    def __init__(self, job_id: str, task: asyncio.Task, total: int | None):
+        self.job_id = job_id
+        self.task = task
+        self.done = 0
+        self.total = total
+        self.reported_at = 0.0
+
+    async def __call__(self, advance: int = 0):
+        self.done += advance
+        if time.monotonic() - self.reported_at < JOB_PROGRESS_INTERVAL:
+            return
+        self.reported_at = time.monotonic()
+        if await redis.hget(_key(self.job_id), 'cancel_requested'):
+            # Cancels the whole job task, including work it is gathering, at its next await.
+            self.task.cancel()
+            return
+        await _update(self.job_id, done=self.done, total=self.total)
+
+
+async def _empty_trash(credentials, user_key: str, progress: Progress) -> dict:
+    result = await drive.empty_trash(credentials=credentials, user_key=user_key)
+    if isinstance(result, str):
+        raise JobFailed(result)
+    await progress(1)
+    return {'emptied': True}
+
+
+async def _bulk(
+        credentials, user_key: str, progress: Progress, operation: str, file_ids: list[str],
+        new_folder_id: str | None = None,
+) -> dict:
+    report = await bulk.bulk_operation(
+        credentials=credentials, operation=operation, file_ids=file_ids, new_folder_id=new_folder_id,
+        user_key=user_key, progress=progress,
+    )
+    return bulk.summary(report)
+
+
+async def _export(credentials, user_key: str, progress: Progress, file_id: str, export_format: str) -> dict:
+    path = await export.render_export(credentials, file_id, export_format, user_key, progress)
+    query = urlencode({'file_id': file_id, 'format': export_format})
+    return {'url': f'/drive/export_file?{query}', 'size': path.stat().st_size}
+
+
+async def _upload(
+        credentials, user_key: str, progress: Progress, spool: str, files: list[list[str]],
+        folder_id: str | None = None,
+) -> list[dict]:
+    service = get_service(credentials)
+    uploads = [
+        UploadFile(open(path, 'rb'), filename=name, headers=Headers({'content-type': content_type}))
+        for name, content_type, path in files
+    ]
+    try:
+        return list(await asyncio.gather(*(
+            drive.upload_file(credentials, service, upload, folder_id, user_key, progress) for upload in uploads
+        )))
+    finally:
+        for upload in uploads:
+            upload.file.close()
+        await run_sync(shutil.rmtree, spool, True)
+
+
+async def _sync(
+        credentials, user_key: str, progress: Progress, root: str, folder_id: str, direction: str, delete: bool,
+        dry_run: bool,
+) -> dict:
+    return await sync.sync(credentials, Path(root), folder_id, direction, user_key, delete, dry_run, progress)
+
+
+async def _thumbnails(
+        credentials, user_key: str, progress: Progress, folder_id: str | None, cursor: str | None, page_size: int,
+        size: int, image_format: str,
+) -> dict:
+    return await thumbnails.render_page(
+        credentials, folder_id, size, image_format, user_key, cursor, page_size, progress,
+    )
+
+
+async def _duplicates(
+        credentials, user_key: str, progress: Progress, folder_id: str | None, min_size: int, limit: int, trash: bool,
+) -> dict:
+    return await duplicates.find_duplicates(credentials, user_key, folder_id, min_size, limit, trash, progress)
+
+
+HANDLERS = {
+    'empty_trash': _empty_trash,
+    'bulk': _bulk,
+    'export': _export,
+    'upload': _upload,
+    'sync': _sync,
+    'thumbnails': _thumbnails,
+    'duplicates': _duplicates,
+}
+
+
+def _spool(spool: Path, index: int, file: UploadFile) -> list[str]:
+    path = spool / str(index)
+    file.file.seek(0)
+    with open(path, 'wb') as target:
+        shutil.copyfileobj(file.file, target)
+    return [file.filename, file.content_type or 'application/octet-stream', str(path)]
+
+
+async def submit_upload(user_key: str, files: list[UploadFile], folder_id: str | None = None) -> dict:
+    # The request body is gone once the response is sent, so the files are spooled to this node's disk;
+    # the job waits in this node's queue, since workers on other nodes cannot read them.
+    spool = Path(JOB_SPOOL_DIR, uuid.uuid4().hex)
+    await run_sync(spool.mkdir, parents=True, exist_ok=True)
+    spooled = [await run_sync(_spool, spool, index, file) for index, file in enumerate(files)]
+    total = sum(file.size or 0 for file in files)
+    return await submit(
+        'upload', user_key, {'spool': str(spool), 'files': spooled, 'folder_id': folder_id}, total, 'bytes',
+    )
+
+
+async def _run(job_id: str):
+    job = await _load(job_id)
+    if job is None or job['status'] != 'queued':
+        # Expired, or cancelled while it was waiting.
+        if job and job['kind'] == 'upload':
+            await run_sync(shutil.rmtree, job['params']['spool'], True)
+        return
+    await _update(job_id, status='running', started_at=time.time())
+    progress = Progress(job_id, asyncio.current_task(), job['total'])
+    try:
+        credentials = await get_credentials(job['user_key'])
+        if not credentials:
+            raise JobFailed('The session has expired')
+        result = await HANDLERS[job['kind']](credentials, job['user_key'], progress, **job['params'])
+    except asyncio.CancelledError:
+        cancelled = await redis.hget(_key(job_id), 'cancel_requested')
+        await _update(
+            job_id, status='cancelled' if cancelled else 'failed', done=progress.done, finished_at=time.time(),
+            error=None if cancelled else 'Interrupted by a server shutdown',
+        )
+    except Exception as error:
+        if isinstance(error, exceptions.HTTPException):
+            detail = error.detail
+        elif isinstance(error, JobFailed):
+            detail = str(error)
+        else:
+            logger.exception('Job %s failed', job_id)
+            detail = f'An error occurred: {error}'
+        await _update(job_id, status='failed', error=detail, done=progress.done, finished_at=time.time())
+    else:
+        await _update(
+            job_id, status='succeeded', result=result, done=progress.done, total=progress.total,
+            finished_at=time.time(),
+        )
+
+
+async def _next_job() -> str | None:
+    # A taken job moves to this instance's processing list, so it is not lost if the process dies while running it.
+    processing = _processing(INSTANCE)
+    job_id = await redis.lmove(_queue(JOB_NODE), processing, 'RIGHT', 'LEFT')
+    if job_id is None:
+        job_id = await redis.blmove(QUEUE_KEY, processing, QUEUE_POLL_TIMEOUT, 'RIGHT', 'LEFT')
+    return job_id
+
+
+async def _worker():
+    while True:
+        try:
+            job_id = await _next_job()
+        except Exception:
+            # Redis is unreachable; the worker waits and tries again instead of dying silently.
+            logger.exception('Could not take a job from the queue')
+            await asyncio.sleep(QUEUE_ERROR_BACKOFF)
+            continue
+        if job_id is None:
+            continue
+        task = _running[job_id] = asyncio.create_task(_run(job_id))
+        try:
+            # wait() instead of awaiting the task, so cancelling the job does not stop the worker.
+            await asyncio.wait([task])
+        finally:
+            _running.pop(job_id, None)
+            await _release(job_id)
+
+
+async def _release(job_id: str):
+    try:
+        await redis.lrem(_processing(INSTANCE), 1, job_id)
+    except Exception:
+        # The job has ended; if it is left in the list, recovery finds it finished and skips it.
+        logger.exception('Could not release job %s', job_id)
+
+
+async def _requeue(job_id: str):
+    job = await _load(job_id)
+    if job is None or job['status'] in TERMINAL_STATUSES:
+        return
+    if not job.get('node'):
+        await _update(job_id, status='queued', done=0, started_at=None)
+        await redis.rpush(QUEUE_KEY, job_id)
+        return
+    # Running it again could upload the same files twice.
+    if job['kind'] == 'upload' and job['node'] == JOB_NODE:
+        await run_sync(shutil.rmtree, job['params']['spool'], True)
+    await _update(job_id, status='failed', error='Interrupted by a server crash', finished_at=time.time())
+
+
+async def _recover():
+    # An instance whose lease ran out died with jobs in its processing list; each is moved out by exactly one instance.
+    processing = _processing(INSTANCE)
+    for instance in await redis.smembers(INSTANCES_KEY):
+        if instance == INSTANCE or await redis.exists(_lease(instance)):
+            continue
+        while job_id := await redis.lmove(_processing(instance), processing, 'RIGHT', 'LEFT'):
+            await _requeue(job_id)
+            await redis.lrem(processing, 1, job_id)
+        await redis.srem(INSTANCES_KEY, instance)
+
+
+async def _keep_lease():
+    while True:
+        try:
+            await redis.set(_lease(INSTANCE), 1, ex=JOB_LEASE_TTL)
+            await redis.sadd(INSTANCES_KEY, INSTANCE)
+            await _recover()
+        except Exception:
+            logger.exception('Could not renew the job lease')
+        await asyncio.sleep(JOB_LEASE_TTL / 3)
+
+
+def start_workers(count: int = JOB_WORKERS):
+    _workers.append(asyncio.create_task(_keep_lease()))
+    _workers.extend(asyncio.create_task(_worker()) for _ in range(count))
+
+
+async def stop_workers():
+    tasks = _workers + list(_running.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _workers.clear()
+    # Jobs interrupted by the shutdown are already marked failed, so nothing is left to recover.
+    await redis.delete(_lease(INSTANCE))
+    await redis.srem(INSTANCES_KEY, INSTANCE)
@@ -0,0 +1,72 @@
+from datetime import datetime
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Fields each view asks Drive for; anything not listed is neither sent nor parsed.
+# The listing views fetch every field DriveFile.as_dict serializes, so none of them is reported empty.
+FIELD_MASKS = {
+    'browse': 'id, name, mimeType, parents, size, md5Checksum, modifiedTime',
+    'search': 'id, name, mimeType, parents, size, md5Checksum, modifiedTime',
+    'trash': 'id, name, mimeType, parents, size, md5Checksum, modifiedTime',
+    # Parents stay in the cached metadata so cache.invalidate can find the folders a file leaves.
+    'download': 'id, name, mimeType, parents, size, md5Checksum, headRevisionId, modifiedTime, version',
+    'index': 'id, name, mimeType, parents, size, md5Checksum, modifiedTime',
+    'sync': 'id, name, mimeType, size, md5Checksum, modifiedTime',
+    'duplicates': 'id, name, mimeType, size, md5Checksum, modifiedTime',
+    # thumbnailLink expires within hours, so it is never part of the cached metadata.
+    'thumbnail': 'id, mimeType, size, md5Checksum, modifiedTime, version, thumbnailLink',
+}
+
+
+def listing_fields(view: str) -> str:
+    return f'nextPageToken, files({FIELD_MASKS[view]})'
+
+
+def parse_time(value: str | None) -> datetime | None:
+    return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+
+
+class DriveFile:
+    __slots__ = ('id', 'name', 'mime_type', 'parents', 'size', 'md5_checksum', 'modified_time')
+
+    def __init__(
+            self, id: str, name: str, mime_type: str, parents: tuple = (), size: int | None = None,
+            md5_checksum: str | None = None, modified_time: datetime | None = None,
+    ):
+        self.id = id
+        self.name = name
+        self.mime_type = mime_type
+        self.parents = parents
+        self.size = size
+        self.md5_checksum = md5_checksum
+        self.modified_time = modified_time
+
+    @classmethod
+    def from_api(cls, file: dict) -> 'DriveFile':
+        size = file.get('size')
+        return cls(
+            file['id'], file.get('name', ''), file.get('mimeType', ''), tuple(file.get('parents', ())),
+            int(size) if size is not None else None, file.get('md5Checksum'), parse_time(file.get('modifiedTime')),
+        )
+
+    @property
+    def is_folder(self) -> bool:
+        return self.mime_type == FOLDER_MIME_TYPE
+
+    def as_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'mime_type': self.mime_type,
+            'parents': list(self.parents),
+            'size': self.size,
+            'md5_checksum': self.md5_checksum,
+            'modified_time': self.modified_time.isoformat() if self.modified_time else None,
+        }
+
+    def __repr__(self) -> str:
+        return f'DriveFile({self.id!r}, {self.name!r}, {self.mime_type!r})'
+
+
+def from_api(files: list[dict]) -> list[DriveFile]:
+    return [DriveFile.from_api(file) for file in files]
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+
+from google.oauth2.credentials import Credentials
+
+from src.config import (
+    PAGE_SIZE, PREFETCH_BUDGET, PREFETCH_BUDGET_WINDOW, PREFETCH_CONCURRENCY, PREFETCH_ENABLED, PREFETCH_FILES,
+    PREFETCH_FOLDERS,
+)
+from src.drive import cache, drive, upstream
+from src.drive.models import FOLDER_MIME_TYPE
+from src.drive.service import get_service
+from src.redis_client import redis
+
+GOOGLE_APPS_PREFIX = 'application/vnd.google-apps.'
+
+logger = logging.getLogger(__name__)
+
+_tasks: set[asyncio.Task] = set()
+_slots = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+
+
+def candidates(files: list[dict]) -> list[tuple[str, str]]:
+    # Opening a folder reads its metadata and then its first page, so both are fetched.
+    items = []
+    folders = [file['id'] for file in files if file['mimeType'] == FOLDER_MIME_TYPE][:PREFETCH_FOLDERS]
+    for folder_id in folders:
+        items += [('file', folder_id), ('listing', folder_id)]
+    # Recently changed binary files are the likeliest downloads; Google Docs are exported instead.
+    downloadable = [file for file in files if not file['mimeType'].startswith(GOOGLE_APPS_PREFIX)]
+    downloadable.sort(key=lambda file: file.get('modifiedTime', ''), reverse=True)
+    items += [('file', file['id']) for file in downloadable[:PREFETCH_FILES]]
+    return items
+
+
+async def _spend(user_key: str) -> bool:
+    # A fixed window per user, shared by all processes.
+    key = f'prefetch:budget:{user_key}:{int(time.time() // PREFETCH_BUDGET_WINDOW)}'
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.incr(key)
+        pipe.expire(key, PREFETCH_BUDGET_WINDOW)
+        spent, _ = await pipe.execute()
+    return spent <= PREFETCH_BUDGET
+
+
+async def _fetch(service, user_key: str, kind: str, item_id: str):
+    field = '' if kind == 'file' else drive.page_field(None, PAGE_SIZE)
+    if await cache.contains(user_key, kind, item_id, field) or not await _spend(user_key):
+        return
+    async with _slots:
+        try:
+            if kind == 'file':
+                await drive.fill_file_metadata(service, item_id, user_key)
+            else:
+                await drive.fill_page(service, drive.folder_query(item_id), user_key, 'listing', item_id)
+        except Exception as error:
+            logger.debug('Prefetch of %s %s failed: %s', kind, item_id, error)
+            return
+    await cache.mark_prefetched(user_key, kind, item_id)
+
+
+async def _prefetch(credentials: Credentials, user_key: str, items: list[tuple[str, str]]):
+    user_bucket = upstream.bucket(credentials.token)
+    if user_bucket.tokens < user_bucket.capacity / 2:
+        # The user is already busy with Drive; prefetching would only slow down what they asked for.
+        return
+    service = get_service(credentials)
+    await asyncio.gather(*(_fetch(service, user_key, kind, item_id) for kind, item_id in items))
+
+
+def schedule(credentials: Credentials | None, user_key: str | None, files: list[dict]):
+    # Runs after the listing is served; the next click finds its metadata and first page in the cache.
+    if not PREFETCH_ENABLED or not user_key or not credentials:
+        return
+    items = candidates(files)
+    if not items:
+        return
+    task = asyncio.create_task(_prefetch(credentials, user_key, items))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def stop():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
@@ -0,0 +1,252 @@
+import hashlib
+import json
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from urllib.parse import quote
+
+from fastapi import exceptions
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+from starlette import status
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+
+from src.drive import blob_cache, drive
+from src.drive.drive import Page
+from src.drive.models import DriveFile
+
+# Responses depend on the session cookie: browsers may keep them, but must revalidate before reuse.
+CACHE_CONTROL = 'private, no-cache'
+HTML = 'text/html'
+JSON = 'application/json'
+NDJSON = 'application/x-ndjson'
+
+
+def negotiate(request: Request) -> str:
+    # The acceptable type with the highest q wins, earlier ones break ties; */* and browsers get the HTML pages.
+    best, best_quality = HTML, 0.0
+    for media_range in request.headers.get('accept', '').split(','):
+        media_type, *params = (part.strip() for part in media_range.split(';'))
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type.lower() in (HTML, JSON, NDJSON) and quality > best_quality:
+            best, best_quality = media_type.lower(), quality
+    return best
+
+
+def login_required(request: Request) -> Response:
+    if negotiate(request) == HTML:
+        return RedirectResponse(url='/auth/login')
+    return JSONResponse({'detail': 'Not authenticated'}, status_code=status.HTTP_401_UNAUTHORIZED)
+
+
+def upstream_error(error: HttpError) -> exceptions.HTTPException:
+    # Drive answers 404 for files that do not exist or are not shared with the user, 401/403 when access is denied.
+    status_code = status.HTTP_400_BAD_REQUEST
+    if error.resp.status == 404:
+        status_code = status.HTTP_404_NOT_FOUND
+    elif error.resp.status in (401, 403):
+        status_code = status.HTTP_403_FORBIDDEN
+    return exceptions.HTTPException(status_code=status_code, detail=f'An error occurred: {error}')
+
+
+def job_accepted(job: dict) -> Response:
+    return JSONResponse(job, status_code=status.HTTP_202_ACCEPTED, headers={'Location': f'/drive/jobs/{job["id"]}'})
+
+
+def redirect_or_json(request: Request, location: str, content) -> Response:
+    # Browsers follow the redirect back to a page; API clients get the outcome without the extra round trip.
+    if negotiate(request) == HTML:
+        return RedirectResponse(url=location, status_code=status.HTTP_303_SEE_OTHER)
+    return JSONResponse(content)
+
+
+def parse_range(range_header: str | None, size: int | None) -> tuple[int, int] | None:
+    if not range_header or size is None or not range_header.startswith('bytes='):
+        return None
+    ranges = range_header[len('bytes='):].split(',')
+    if len(ranges) != 1:
+        # Multipart byteranges are not supported, the full body is a valid answer.
+        return None
+    first, _, last = ranges[0].strip().partition('-')
+    try:
+        if not first:
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise ValueError(f'Range not satisfiable: {range_header}')
+    return start, end
+
+
+def content_disposition(file_name: str, disposition: str = 'attachment') -> str:
+    fallback = file_name.encode('ascii', 'ignore').decode().replace('"', '')
+    return f'{disposition}; filename="{fallback}"; filename*=UTF-8\'\'{quote(file_name)}'
+
+
+def _modified_time(file: dict) -> datetime | None:
+    if 'modifiedTime' not in file:
+        return None
+    return datetime.fromisoformat(file['modifiedTime'].replace('Z', '+00:00')).replace(microsecond=0)
+
+
+def cache_headers(etag: str, last_modified: datetime | None = None) -> dict:
+    headers = {'ETag': etag, 'Cache-Control': CACHE_CONTROL, 'Vary': 'Cookie'}
+    if last_modified:
+        headers['Last-Modified'] = format_datetime(last_modified, usegmt=True)
+    return headers
+
+
+def file_headers(metadata: dict) -> dict:
+    # Drive only reports md5Checksum for binary content; other files change version on every edit.
+    version = metadata.get('md5Checksum') or f'{metadata["id"]}-{metadata.get("version", metadata.get("modifiedTime"))}'
+    return cache_headers(f'"{version}"', _modified_time(metadata))
+
+
+def thumbnail_headers(metadata: dict, size: int, image_format: str, negotiated: bool) -> dict:
+    version = metadata.get('md5Checksum') or f'{metadata["id"]}-{metadata.get("version")}'
+    headers = cache_headers(f'"{version}-{size}-{image_format}"', _modified_time(metadata))
+    if negotiated:
+        headers['Vary'] = 'Cookie, Accept'
+    return headers
+
+
+def listing_headers(page: Page, media_type: str = HTML) -> dict:
+    state = [(file['id'], file['name'], file.get('modifiedTime'), file.get('size')) for file in page.files]
+    digest = hashlib.sha1(json.dumps([state, page.next_cursor, page.indexed_at, media_type]).encode()).hexdigest()
+    # The page is rendered, so the ETag is weak: equal listings are equivalent, not byte-identical.
+    # No Last-Modified: removing a child changes the listing without changing any remaining modifiedTime.
+    return {**cache_headers(f'W/"{digest}"'), 'Vary': 'Cookie, Accept'}
+
+
+def _etags(header: str) -> list[str]:
+    return [tag.strip().removeprefix('W/') for tag in header.split(',')]
+
+
+def is_not_modified(request: Request, headers: dict) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        return '*' in _etags(if_none_match) or headers['ETag'].removeprefix('W/') in _etags(if_none_match)
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and 'Last-Modified' in headers:
+        try:
+            return parsedate_to_datetime(headers['Last-Modified']) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+
+def page_json(page: Page) -> dict:
+    return {
+        'files': [DriveFile.from_api(file).as_dict() for file in page.files],
+        'next_cursor': page.next_cursor,
+        'indexed_at': page.indexed_at,
+    }
+
+
+async def iter_ndjson(page: Page, next_page):
+    # One file per line, following the cursors until Drive runs out of pages; only one page is held at a time.
+    while True:
+        for file in page.files:
+            yield json.dumps(DriveFile.from_api(file).as_dict()) + '\n'
+        cursor = page.next_cursor
+        if not cursor:
+            return
+        try:
+            page = await next_page(cursor)
+        except Exception as error:
+            page = f'An error occurred: {error}'
+        if not isinstance(page, Page):
+            # The status line is long gone; the cursor lets the client resume from here.
+            detail = page if isinstance(page, str) else 'The listing is no longer available'
+            yield json.dumps({'error': detail, 'cursor': cursor}) + '\n'
+            return
+
+
+def listing_response(request: Request, page: Page, next_page, render) -> Response:
+    # next_page(cursor) fetches a following page for NDJSON; render(headers) builds the HTML response.
+    media_type = negotiate(request)
+    if media_type == NDJSON:
+        return StreamingResponse(
+            iter_ndjson(page, next_page), media_type=NDJSON,
+            headers={'Cache-Control': CACHE_CONTROL, 'Vary': 'Cookie, Accept'},
+        )
+    headers = listing_headers(page, media_type)
+    if is_not_modified(request, headers):
+        return not_modified(headers)
+    if media_type == JSON:
+        return JSONResponse(page_json(page), headers=headers)
+    return render(headers)
+
+
+async def stream_file(request: Request, credentials: Credentials | None, metadata: dict) -> Response:
+    size = int(metadata['size']) if 'size' in metadata else None
+    validators = file_headers(metadata)
+    # Answered from the cached metadata alone, without touching the content.
+    if is_not_modified(request, validators):
+        return not_modified(validators)
+    headers = {
+        **validators,
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': content_disposition(metadata['name']),
+    }
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if if_range and if_range not in (validators['ETag'], validators.get('Last-Modified')):
+        # The client's partial copy is stale, so it gets the whole current file.
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers={
+            'Content-Range': f'bytes */{size}',
+        })
+
+    if byte_range:
+        start, end = byte_range
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        headers['Content-Length'] = str(end - start + 1)
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+    else:
+        start, end = 0, None
+        if size is not None:
+            headers['Content-Length'] = str(size)
+        status_code = status.HTTP_200_OK
+
+    # metadata was fetched with the caller's credentials, so a cached blob is only served to users who can read it.
+    media_type = metadata.get('mimeType', 'application/octet-stream')
+    path = await blob_cache.lookup(metadata)
+    if path and byte_range:
+        return StreamingResponse(
+            blob_cache.iter_blob(path, start, end), status_code=status_code, media_type=media_type, headers=headers,
+        )
+    if path:
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    chunks = drive.iter_file_content(credentials, metadata['id'], start, end)
+    # Pull the first chunk before committing to a status code, so Drive errors are reported properly.
+    try:
+        first_chunk = await anext(chunks, b'')
+    except HttpError as error:
+        raise upstream_error(error)
+
+    async def body():
+        yield first_chunk
+        async for chunk in chunks:
+            yield chunk
+
+    content = body()
+    if not byte_range and blob_cache.cacheable(metadata):
+        content = blob_cache.write_through(content, blob_cache.blob_path(metadata), size, blob_cache.evict)
+    return StreamingResponse(content, status_code=status_code, media_type=media_type, headers=headers)
@@ -1,17 +1,26 @@
-import io
 import json
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, Cookie, UploadFile, exceptions
-from fastapi.responses import Response, StreamingResponse
-from google.oauth2.credentials import Credentials
+from fastapi import APIRouter, Cookie, Query, UploadFile, exceptions
+from fastapi.responses import JSONResponse, StreamingResponse
+from googleapiclient.errors import HttpError
 from starlette import status
 from starlette.requests import Request
-from starlette.responses import HTMLResponse, RedirectResponse
+from starlette.responses import FileResponse, HTMLResponse, RedirectResponse
 
-from src.auth.auth_config import sessions, templates
-from src.drive import drive
+from src.auth.auth_config import templates
+from src.auth.credentials import get_credentials
+from src.config import PAGE_SIZE, SEARCH_INDEX_ENABLED, SYNC_ROOT, THUMBNAIL_SIZE
+from src.drive import (
+    archive, bulk, cache, drive, duplicates, export, images, jobs, models, prefetch, search_index, thumbnails,
+    walker,
+)
 from src.drive.file_types_mapping import FILE_TYPES_MAPPING
+from src.drive.responses import (
+    HTML, content_disposition, is_not_modified, job_accepted, listing_response, login_required, negotiate,
+    not_modified, redirect_or_json, stream_file, thumbnail_headers, upstream_error,
+)
+from src.drive.schemas import BulkRequest, SyncRequest
 
 router = APIRouter(
     prefix='/drive',
@@ -19,38 +28,43 @@ router = APIRouter(
 )
 
 
-def get_credentials(session_id) -> Credentials | None:
-    credentials = None
-    if session_id in sessions:
-        token = sessions[session_id]
-        if token:
-            token_json = json.loads(Credentials(token).to_json()).get('token')
-            credentials = Credentials(token_json.get('access_token'))
-        return credentials
-
-
 @router.get('/folders_and_files', response_class=HTMLResponse)
 async def get_folders_and_files(
         request: Request,
         file_id: str | None = None,
+        cursor: str | None = None,
+        page_size: int = Query(PAGE_SIZE, ge=1, le=PAGE_SIZE),
         session_id: Optional[str] = Cookie(None),
 ):
-    credentials = get_credentials(session_id)
+    credentials = await get_credentials(session_id)
     if not credentials:
-        return RedirectResponse(url='/auth/login')
-    folders_and_files = await drive.folders_and_files(credentials=credentials, file_id=file_id)
-    if isinstance(folders_and_files, bytes):
-        file_like_object = io.BytesIO(folders_and_files)
-        return StreamingResponse(file_like_object, media_type='application/octet-stream')
+        return login_required(request)
+
+    async def fetch(page_cursor: str | None):
+        return await drive.folders_and_files(
+            credentials=credentials, file_id=file_id, user_key=session_id, cursor=page_cursor, page_size=page_size,
+        )
+
+    folders_and_files = await fetch(cursor)
+    if isinstance(folders_and_files, dict):
+        return await stream_file(request, credentials, folders_and_files)
     elif isinstance(folders_and_files, bool):
-        return RedirectResponse(url='/auth/login')
-    elif not isinstance(folders_and_files, list) and not folders_and_files:
+        return login_required(request)
+    elif folders_and_files is None:
+        if negotiate(request) != HTML:
+            raise exceptions.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='File not found')
         return RedirectResponse(url='/drive/folders_and_files')
-    return templates.TemplateResponse(
-        'folders_and_files.html', {
-            'request': request, 'folders_and_files': folders_and_files, 'files_types_mapping': FILE_TYPES_MAPPING,
-        },
-    )
+    prefetch.schedule(credentials, session_id, folders_and_files.files)
+
+    def render(headers: dict):
+        return templates.TemplateResponse(
+            'folders_and_files.html', {
+                'request': request, 'folders_and_files': models.from_api(folders_and_files.files),
+                'next_cursor': folders_and_files.next_cursor, 'files_types_mapping': FILE_TYPES_MAPPING,
+            },
+            headers=headers,
+        )
+    return listing_response(request, folders_and_files, fetch, render)
 
 
 @router.get('/search')
@@ -58,36 +72,144 @@ async def search(
         request: Request,
         file_name: str | None = None,
         folder_name: str | None = None,
-        page_size: int = 15,
+        mode: Literal['exact', 'prefix', 'substring'] = 'exact',
+        mime_type: str | None = None,
+        min_size: int | None = None,
+        max_size: int | None = None,
+        cursor: str | None = None,
+        page_size: int = Query(15, ge=1, le=PAGE_SIZE),
         session_id: Optional[str] = Cookie(None),
 ):
-    credentials = get_credentials(session_id)
+    credentials = await get_credentials(session_id)
     if not credentials:
-        return RedirectResponse(url='/auth/login')
-    search_list = await drive.search_file(
-        credentials=credentials, file_name=file_name, folder_name=folder_name, page_size=page_size,
-    )
-    return templates.TemplateResponse(
-        'search.html', {'request': request, 'search_list': search_list, 'files_types_mapping': FILE_TYPES_MAPPING},
-    )
+        return login_required(request)
+
+    async def fetch(page_cursor: str | None):
+        page = None
+        if SEARCH_INDEX_ENABLED:
+            page = await search_index.search(
+                credentials=credentials, user_key=session_id, text=file_name or None, mode=mode,
+                parent=folder_name or None, mime_type=mime_type, min_size=min_size, max_size=max_size,
+                page_size=page_size, cursor=page_cursor,
+            )
+        if page is None:
+            page = await drive.search_file(
+                credentials=credentials, file_name=file_name, folder_name=folder_name, page_size=page_size,
+                cursor=page_cursor, mode=mode, mime_type=mime_type, min_size=min_size, max_size=max_size,
+            )
+        return page
+
+    search_list = await fetch(cursor)
+
+    def render(headers: dict):
+        return templates.TemplateResponse(
+            'search.html', {
+                'request': request, 'search_list': models.from_api(search_list.files),
+                'next_cursor': search_list.next_cursor, 'indexed_at': search_list.indexed_at,
+                'files_types_mapping': FILE_TYPES_MAPPING,
+            },
+            headers=headers,
+        )
+    return listing_response(request, search_list, fetch, render)
+
+
+@router.get('/folder_stats')
+async def folder_stats(
+        request: Request,
+        folder_id: str | None = None,
+        session_id: Optional[str] = Cookie(None),
+):
+    credentials = await get_credentials(session_id)
+    if not credentials:
+        return login_required(request)
+
+    async def lines():
+        async for stats in walker.folder_stats(credentials=credentials, folder_id=folder_id, user_key=session_id):
+            yield json.dumps(stats) + '\n'
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
+async def _duplicates(
+        request: Request, folder_id: str | None, min_size: int, limit: int, trash: bool, background: bool,
+        session_id: str | None,
+):
+    credentials = await get_credentials(session_id)
+    if not credentials:
+        return login_required(request)
+    params = {'folder_id': folder_id, 'min_size': min_size, 'limit': limit, 'trash': trash}
+    if background or await duplicates.needs_job(credentials, session_id, folder_id):
+        return job_accepted(await jobs.submit('duplicates', session_id, params))
+    return await duplicates.find_duplicates(credentials=credentials, user_key=session_id, **params)
+
+
+@router.get('/duplicates')
+async def find_duplicates(
+        request: Request,
+        folder_id: str | None = None,
+        min_size: int = Query(1, ge=0),
+        limit: int = Query(100, ge=1, le=1000),
+        background: bool = False,
+        session_id: Optional[str] = Cookie(None),
+):
+    return await _duplicates(request, folder_id, min_size, limit, False, background, session_id)
+
+
+@router.post('/duplicates')
+async def trash_duplicates(
+        request: Request,
+        folder_id: str | None = None,
+        min_size: int = Query(1, ge=0),
+        limit: int = Query(100, ge=1, le=1000),
+        background: bool = False,
+        session_id: Optional[str] = Cookie(None),
+):
+    # Trashes every copy but the oldest of the groups the matching GET reports.
+    return await _duplicates(request, folder_id, min_size, limit, True, background, session_id)
 
 
 @router.get('/download')
 async def download_file(
+        request: Request,
         file_id: str | None = None,
         file_name: str | None = None,
         session_id: Optional[str] = Cookie(None),
 ):
-    credentials = get_credentials(session_id)
+    credentials = await get_credentials(session_id)
     if not credentials:
-        return RedirectResponse(url='/auth/login')
-    result = await drive.download_file(credentials=credentials, file_id=file_id, file_name=file_name)
+        return login_required(request)
+    try:
+        result = await drive.download_file(
+            credentials=credentials, file_id=file_id, file_name=file_name, user_key=session_id,
+        )
+    except HttpError as error:
+        raise upstream_error(error)
     if not result:
-        return exceptions.HTTPException(
+        raise exceptions.HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail='No file_id or file_name provided',
         )
-    file_like_object = io.BytesIO(result)
-    return StreamingResponse(file_like_object, media_type='application/octet-stream')
+    return await stream_file(request, credentials, result)
+
+
+@router.get('/download_folder')
+async def download_folder(
+        request: Request,
+        folder_id: str | None = None,
+        session_id: Optional[str] = Cookie(None),
+):
+    credentials = await get_credentials(session_id)
+    if not credentials:
+        return login_required(request)
+    try:
+        folder = await drive.get_file_metadata(credentials, folder_id or 'root', user_key=session_id)
+    except HttpError as error:
+        raise upstream_error(error)
+    if folder['mimeType'] != walker.FOLDER_MIME_TYPE:
+        raise exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Not a folder')
+    return StreamingResponse(
+        archive.stream_zip(credentials=credentials, folder_id=folder['id'], user_key=session_id),
+        media_type='application/zip',
+        headers={'Content-Disposition': content_disposition(f'{folder["name"]}.zip')},
+    )
 
 
 @router.post('/create_files')
@@ -95,144 +217,324 @@ async def upload_files(
         request: Request,
         files: List[UploadFile],
         folder_id: str | None = None,
+        background: bool = False,
         session_id: Optional[str] = Cookie(None),
 ):
-    credentials = get_credentials(session_id)
+    credentials = await get_credentials(session_id)
     if not credentials:
-        return RedirectResponse(url='/auth/login')
-    result = await drive.upload_files(credentials=credentials, files=files, folder_id=folder_id)
-    if isinstance(result, str):
-        return exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
-    response = Response(status_code=303)
-    response.headers['Location'] = f'/drive/folders_and_files/?&file_id={result[0]}'
-    return response
+        return login_required(request)
+    if background:
+        return job_accepted(await jobs.submit_upload(session_id, files, folder_id))
+    results = await drive.upload_files(credentials=credentials, files=files, folder_id=folder_id, user_key=session_id)
+    uploaded = [result for result in results if 'error' not in result]
+    if len(uploaded) < len(results):
+        status_code = status.HTTP_207_MULTI_STATUS if uploaded else status.HTTP_400_BAD_REQUEST
+        return JSONResponse(results, status_code=status_code)
+    parents = uploaded[0]['parents'] if uploaded else []
+    location = f'/drive/folders_and_files/?&file_id={parents[0]}' if parents else '/drive/folders_and_files'
+    return redirect_or_json(request, location, results)
+
+
+@router.post('/bulk')
+async def bulk_operation(
+        request: Request,
+        bulk_request: BulkRequest,
+        background: bool = False,
+        session_id: Optional[str] = Cookie(None),
+):
+    credentials = await get_credentials(session_id)
+    if not credentials:
+        return login_required(request)
+    if bulk_request.operation == 'move' and not bulk_request.new_folder_id:
+        raise exceptions.HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail='new_folder_id is required to move files',
+        )
+    if background:
+        params = bulk_request.model_dump()
+        return job_accepted(await jobs.submit('bulk', session_id, params, len(set(bulk_request.file_ids))))
+    report = await bulk.bulk_operation(
+        credentials=credentials, operation=bulk_request.operation, file_ids=bulk_request.file_ids,
+        new_folder_id=bulk_request.new_folder_id, user_key=session_id,
+    )
+    return bulk.summary(report)
+
+
+@router.post('/sync')
+async def sync_folder(
+        request: Request,
+        sync_request: SyncRequest,
+        session_id: Optional[str] = Cookie(None),
+):
+    credentials = await get_credentials(session_id)
+    if not credentials:
+        return login_required(request)
+    if SYNC_ROOT is None:
+        raise exceptions.HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Sync is disabled')
+    root = (SYNC_ROOT / sync_request.local_path).resolve()
+    if not root.is_relative_to(SYNC_ROOT.resolve()) or not root.is_dir():
+        raise exceptions.HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail='local_path must be a directory below the sync root',
+        )
+    params = {**sync_request.model_dump(exclude={'local_path'}), 'root': str(root)}
+    return job_accepted(await jobs.submit('sync', session_id, params, unit='bytes'))
 
 
 @router.get('/create_folder')
 async def create_folder(
+        request: Request,
         folder_name: str,
         parent_folder_id: str | None = None,
         session_id: Optional[str] = Cookie(None),
 ):
-    credentials = get_credentials(session_id)
+    credentials = await get_credentials(session_id)
     if not credentials:
-        return RedirectResponse(url='/auth/login')
+        return login_required(request)
     result = await drive.create_folder(
-        credentials=credentials, folder_name=folder_name, parent_folder_id=parent_folder_id,
+        credentials=credentials, folder_name=folder_name, parent_folder_id=parent_folder_id, user_key=session_id,
     )
     if isinstance(result, str):
-        return exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
-    response = Response(status_code=303)
-    response.headers['Location'] = f'/drive/folders_and_files/?&file_id={result[0]}'
-    return response
+        raise exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
+    return redirect_or_json(request, f'/drive/folders_and_files/?&file_id={result[0]}', {'parents': result})
 
 
 @router.get('/move_file')
 async def move_file(
+        request: Request,
         file_id: str,
         new_folder_id: str,
         session_id: Optional[str] = Cookie(None),
 ):
-    credentials = get_credentials(session_id)
+    credentials = await get_credentials(session_id)
     if not credentials:
-        return RedirectResponse(url='/auth/login')
-    result = await drive.move_file(credentials=credentials, file_id=file_id, new_folder_id=new_folder_id)
+        return login_required(request)
+    result = await drive.move_file(
+        credentials=credentials, file_id=file_id, new_folder_id=new_folder_id, user_key=session_id,
+    )
     if isinstance(result, str):
-        return exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
-    response = Response(status_code=303)
-    response.headers['Location'] = f'/drive/folders_and_files/?&file_id={new_folder_id}'
-    return response
+        raise exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
+    return redirect_or_json(
+        request, f'/drive/folders_and_files/?&file_id={new_folder_id}', {'id': file_id, 'parents': [new_folder_id]},
+    )
 
 
 @router.get('/move_to_trash')
 async def move_to_trash(
+        request: Request,
         file_id: str | None = None,
         session_id: Optional[str] = Cookie(None),
 ):
-    credentials = get_credentials(session_id)
+    credentials = await get_credentials(session_id)
     if not credentials:
-        return RedirectResponse(url='/auth/login')
-    result = await drive.move_to_trash(credentials=credentials, file_id=file_id)
+        return login_required(request)
+    result = await drive.move_to_trash(credentials=credentials, file_id=file_id, user_key=session_id)
     if isinstance(result, str):
-        return exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
-    response = Response(status_code=303)
-    response.headers['Location'] = '/drive/list_files_in_trash'
-    return response
+        raise exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
+    return redirect_or_json(request, '/drive/list_files_in_trash', {'id': file_id, 'trashed': True})
 
 
 @router.get('/recover_from_trash')
 async def recover_from_trash(
+        request: Request,
         file_id: str | None = None,
         session_id: Optional[str] = Cookie(None),
 ):
-    credentials = get_credentials(session_id)
+    credentials = await get_credentials(session_id)
     if not credentials:
-        return RedirectResponse(url='/auth/login')
-    result = await drive.recover_from_trash(credentials=credentials, file_id=file_id)
+        return login_required(request)
+    result = await drive.recover_from_trash(credentials=credentials, file_id=file_id, user_key=session_id)
     if isinstance(result, str):
-        return exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
-    response = Response(status_code=303)
-    response.headers['Location'] = '/drive/folders_and_files'
-    return response
+        raise exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
+    return redirect_or_json(request, '/drive/folders_and_files', {'id': file_id, 'trashed': False})
 
 
 @router.get('/empty_trash')
 async def empty_trash(
+        request: Request,
+        background: bool = False,
         session_id: Optional[str] = Cookie(None),
 ):
-    credentials = get_credentials(session_id)
+    credentials = await get_credentials(session_id)
     if not credentials:
-        return RedirectResponse(url='/auth/login')
-    result = await drive.empty_trash(credentials=credentials)
+        return login_required(request)
+    if background:
+        return job_accepted(await jobs.submit('empty_trash', session_id, {}, 1))
+    result = await drive.empty_trash(credentials=credentials, user_key=session_id)
     if isinstance(result, str):
-        return exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
-    response = Response(status_code=303)
-    response.headers['Location'] = '/drive/list_files_in_trash'
-    return response
+        raise exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
+    return redirect_or_json(request, '/drive/list_files_in_trash', {'emptied': True})
 
 
 @router.get('/list_files_in_trash')
 async def list_files_in_trash(
         request: Request,
+        cursor: str | None = None,
+        page_size: int = Query(PAGE_SIZE, ge=1, le=PAGE_SIZE),
         session_id: Optional[str] = Cookie(None),
 ):
-    credentials = get_credentials(session_id)
+    credentials = await get_credentials(session_id)
     if not credentials:
-        return RedirectResponse(url='/auth/login')
-    trash_list = await drive.list_files_in_trash(credentials=credentials)
+        return login_required(request)
+
+    async def fetch(page_cursor: str | None):
+        return await drive.list_files_in_trash(
+            credentials=credentials, user_key=session_id, cursor=page_cursor, page_size=page_size,
+        )
+
+    trash_list = await fetch(cursor)
     if isinstance(trash_list, str):
-        return exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=trash_list)
-    return templates.TemplateResponse(
-        'trash.html', {'request': request, 'trash_list': trash_list, 'files_types_mapping': FILE_TYPES_MAPPING},
-    )
+        raise exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=trash_list)
+
+    def render(headers: dict):
+        return templates.TemplateResponse(
+            'trash.html', {
+                'request': request, 'trash_list': models.from_api(trash_list.files),
+                'next_cursor': trash_list.next_cursor, 'files_types_mapping': FILE_TYPES_MAPPING,
+            },
+            headers=headers,
+        )
+    return listing_response(request, trash_list, fetch, render)
 
 
 @router.get('/delete_file')
 async def delete_file(
+        request: Request,
         file_id: str | None = None,
         session_id: Optional[str] = Cookie(None),
 ):
-    credentials = get_credentials(session_id)
+    credentials = await get_credentials(session_id)
     if not credentials:
-        return RedirectResponse(url='/auth/login')
-    result = await drive.delete_file(credentials=credentials, file_id=file_id)
+        return login_required(request)
+    result = await drive.delete_file(credentials=credentials, file_id=file_id, user_key=session_id)
     if isinstance(result, str):
-        return exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
-    response = Response(status_code=303)
-    response.headers['Location'] = '/drive/folders_and_files'
-    return response
+        raise exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
+    return redirect_or_json(request, '/drive/folders_and_files', {'id': file_id, 'deleted': True})
 
 
-@router.get('/export_file_to_pdf')
+@router.get('/export_file')
 async def export_file(
+        request: Request,
         file_id: str,
+        export_format: str = Query('pdf', alias='format'),
+        background: bool = False,
         session_id: Optional[str] = Cookie(None),
 ):
-    credentials = get_credentials(session_id)
+    credentials = await get_credentials(session_id)
     if not credentials:
-        return RedirectResponse(url='/auth/login')
-    result = await drive.export_file(credentials=credentials, file_id=file_id)
-    if isinstance(result, str):
-        return exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
-    file_like_object = io.BytesIO(result)
-    return StreamingResponse(file_like_object, media_type='application/octet-stream')
+        return login_required(request)
+    if background:
+        params = {'file_id': file_id, 'export_format': export_format}
+        return job_accepted(await jobs.submit('export', session_id, params, unit='bytes'))
+    return await export.export_file(
+        credentials=credentials, file_id=file_id, export_format=export_format, user_key=session_id,
+    )
+
+
+@router.get('/export_file_to_pdf')
+async def export_file_to_pdf(
+        request: Request,
+        file_id: str,
+        session_id: Optional[str] = Cookie(None),
+):
+    return await export_file(request=request, file_id=file_id, export_format='pdf', session_id=session_id)
+
+
+@router.get('/thumbnail')
+async def thumbnail(
+        request: Request,
+        file_id: str,
+        size: int = Query(THUMBNAIL_SIZE, ge=thumbnails.MIN_SIZE, le=thumbnails.MAX_SIZE),
+        image_format: Literal['webp', 'jpeg'] | None = Query(None, alias='format'),
+        session_id: Optional[str] = Cookie(None),
+):
+    credentials = await get_credentials(session_id)
+    if not credentials:
+        return login_required(request)
+    negotiated = image_format is None
+    if negotiated:
+        image_format = 'webp' if images.MEDIA_TYPES['webp'] in request.headers.get('accept', '') else 'jpeg'
+    service, file = await thumbnails.thumbnail_target(credentials, file_id, session_id)
+    headers = thumbnail_headers(file, size, image_format, negotiated)
+    # Answered from the cached metadata alone, without reading or rendering the thumbnail.
+    if is_not_modified(request, headers):
+        return not_modified(headers)
+    path = await thumbnails.thumbnail(credentials, service, file, size, image_format)
+    if path is None:
+        raise exceptions.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No preview available')
+    return FileResponse(path, media_type=images.MEDIA_TYPES[image_format], headers=headers)
+
+
+@router.post('/thumbnails')
+async def folder_thumbnails(
+        request: Request,
+        folder_id: str | None = None,
+        cursor: str | None = None,
+        page_size: int = Query(PAGE_SIZE, ge=1, le=PAGE_SIZE),
+        size: int = Query(THUMBNAIL_SIZE, ge=thumbnails.MIN_SIZE, le=thumbnails.MAX_SIZE),
+        image_format: Literal['webp', 'jpeg'] = Query('webp', alias='format'),
+        background: bool = False,
+        session_id: Optional[str] = Cookie(None),
+):
+    credentials = await get_credentials(session_id)
+    if not credentials:
+        return login_required(request)
+    if background:
+        params = {
+            'folder_id': folder_id, 'cursor': cursor, 'page_size': page_size, 'size': size,
+            'image_format': image_format,
+        }
+        return job_accepted(await jobs.submit('thumbnails', session_id, params))
+    return await thumbnails.render_page(
+        credentials=credentials, folder_id=folder_id, size=size, image_format=image_format, user_key=session_id,
+        cursor=cursor, page_size=page_size,
+    )
+
+
+@router.get('/jobs/{job_id}')
+async def get_job(
+        request: Request,
+        job_id: str,
+        session_id: Optional[str] = Cookie(None),
+):
+    if not session_id:
+        return login_required(request)
+    job = await jobs.get(job_id, session_id)
+    if job is None:
+        raise exceptions.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Job not found')
+    return job
+
+
+@router.delete('/jobs/{job_id}')
+async def cancel_job(
+        request: Request,
+        job_id: str,
+        session_id: Optional[str] = Cookie(None),
+):
+    if not session_id:
+        return login_required(request)
+    job = await jobs.cancel(job_id, session_id)
+    if job is None:
+        raise exceptions.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Job not found')
+    return job
+
+
+@router.get('/jobs/{job_id}/events')
+async def job_events(
+        request: Request,
+        job_id: str,
+        session_id: Optional[str] = Cookie(None),
+):
+    if not session_id:
+        return login_required(request)
+    if await jobs.get(job_id, session_id) is None:
+        raise exceptions.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Job not found')
+    return StreamingResponse(
+        jobs.events(job_id, session_id), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'},
+    )
+
+
+@router.get('/cache_stats')
+async def cache_stats(request: Request, session_id: Optional[str] = Cookie(None)):
+    credentials = await get_credentials(session_id)
+    if not credentials:
+        return login_required(request)
+    return await cache.stats()
@@ -0,0 +1,17 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+
+class BulkRequest(BaseModel):
+    operation: Literal['move', 'trash', 'restore', 'delete']
+    file_ids: list[str] = Field(min_length=1)
+    new_folder_id: str | None = None
+
+
+class SyncRequest(BaseModel):
+    local_path: str
+    folder_id: str
+    direction: Literal['push', 'pull'] = 'push'
+    delete: bool = False
+    dry_run: bool = False
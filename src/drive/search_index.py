@@ -0,0 +1,290 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import uuid
+import weakref
+from contextlib import closing, contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from google.oauth2.credentials import Credentials
+
+from src.config import PAGE_SIZE, SEARCH_INDEX_DIR, SEARCH_INDEX_SYNC_INTERVAL
+from src.drive import cache
+from src.drive.drive import Page, iter_pages
+from src.drive.executor import run_sync
+from src.drive.models import FOLDER_MIME_TYPE, listing_fields
+from src.drive.service import get_service
+from src.drive.upstream import execute
+from src.redis_client import redis
+
+INDEX_FIELDS = listing_fields('index')
+CHANGE_FIELDS = (
+    'nextPageToken, newStartPageToken, '
+    'changes(fileId, removed, file(id, name, mimeType, parents, size, md5Checksum, modifiedTime, trashed))'
+)
+CURSOR_PREFIX = 'index:'
+CRAWL_POLL_INTERVAL = 1
+# The lock expires soon after a crawling process dies; a live crawl keeps extending it.
+CRAWL_LOCK_TTL = 60
+RELEASE_LOCK = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    mime_type TEXT,
+    size INTEGER,
+    parent TEXT,
+    md5_checksum TEXT,
+    modified_time TEXT
+);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+CREATE INDEX IF NOT EXISTS files_parent ON files (parent);
+CREATE INDEX IF NOT EXISTS files_mime_type ON files (mime_type);
+CREATE INDEX IF NOT EXISTS files_md5_checksum ON files (md5_checksum, size);
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(name, content='files', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts (rowid, name) VALUES (new.rowid, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+    INSERT INTO files_fts (files_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_au AFTER UPDATE ON files BEGIN
+    INSERT INTO files_fts (files_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+    INSERT INTO files_fts (rowid, name) VALUES (new.rowid, new.name);
+END;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+'''
+UPSERT = '''
+INSERT INTO files (id, name, mime_type, size, parent, md5_checksum, modified_time)
+VALUES (:id, :name, :mime_type, :size, :parent, :md5_checksum, :modified_time)
+ON CONFLICT (id) DO UPDATE SET
+    name = excluded.name, mime_type = excluded.mime_type, size = excluded.size, parent = excluded.parent,
+    md5_checksum = excluded.md5_checksum, modified_time = excluded.modified_time
+'''
+
+logger = logging.getLogger(__name__)
+
+_crawls: dict[str, asyncio.Task] = {}
+_sync_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+
+
+def index_path(user_id: str) -> Path:
+    return Path(SEARCH_INDEX_DIR, f'{user_id}.sqlite3')
+
+
+@contextmanager
+def connect(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with closing(sqlite3.connect(path, timeout=30)) as connection:
+        connection.row_factory = sqlite3.Row
+        connection.executescript(SCHEMA)
+        with connection:
+            yield connection
+
+
+def _row(file: dict) -> dict:
+    return {
+        'id': file['id'],
+        'name': file['name'],
+        'mime_type': file.get('mimeType'),
+        'size': int(file['size']) if 'size' in file else None,
+        'parent': file.get('parents', [None])[0],
+        'md5_checksum': file.get('md5Checksum'),
+        'modified_time': file.get('modifiedTime'),
+    }
+
+
+def _file(row: sqlite3.Row) -> dict:
+    file = {'id': row['id'], 'name': row['name'], 'mimeType': row['mime_type'], 'parents': [row['parent']]}
+    if row['size'] is not None:
+        file['size'] = str(row['size'])
+    if row['md5_checksum']:
+        file['md5Checksum'] = row['md5_checksum']
+    if row['modified_time']:
+        file['modifiedTime'] = row['modified_time']
+    return file
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+def _read_meta(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    with connect(path) as connection:
+        return dict(connection.execute('SELECT key, value FROM meta').fetchall())
+
+
+def _write_files(path: Path, files: list[dict], removed_ids: list[str] = (), meta: dict | None = None):
+    with connect(path) as connection:
+        connection.executemany(UPSERT, [_row(file) for file in files])
+        connection.executemany('DELETE FROM files WHERE id = ?', [(file_id,) for file_id in removed_ids])
+        if meta:
+            connection.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', meta.items())
+
+
+def _search(
+        path: Path, text: str | None, mode: str, parent: str | None, mime_type: str | None, min_size: int | None,
+        max_size: int | None, limit: int, offset: int,
+) -> list[dict]:
+    clauses, params = [], []
+    if text and mode == 'exact':
+        clauses.append('name = ?')
+        params.append(text)
+    elif text:
+        # The trigram tokenizer answers LIKE patterns of three or more characters from the FTS index.
+        # An ESCAPE clause makes it scan instead, so it is only added when the text needs one.
+        escape = ''
+        if any(char in text for char in '\\%_'):
+            text = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            escape = " ESCAPE '\\'"
+        clauses.append(f'rowid IN (SELECT rowid FROM files_fts WHERE name LIKE ?{escape})')
+        params.append(f'{text}%' if mode == 'prefix' else f'%{text}%')
+    for clause, value in (
+            ('parent = ?', parent), ('mime_type = ?', mime_type), ('size >= ?', min_size), ('size <= ?', max_size),
+    ):
+        if value is not None:
+            clauses.append(clause)
+            params.append(value)
+    where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+    with connect(path) as connection:
+        rows = connection.execute(
+            f'SELECT * FROM files {where} ORDER BY name, id LIMIT ? OFFSET ?', (*params, limit, offset),
+        ).fetchall()
+    return [_file(row) for row in rows]
+
+
+async def crawl(service, user_id: str):
+    path = index_path(user_id)
+    # Each crawl builds its own file, so one that outlives its lock cannot corrupt the next.
+    building = path.with_name(f'{path.stem}.{uuid.uuid4().hex}.building')
+    try:
+        # Changes made while the crawl runs are picked up by the first sync from this token.
+        response = await execute(service.changes().getStartPageToken())
+        async for files in iter_pages(service, 'trashed=false', PAGE_SIZE, INDEX_FIELDS):
+            await run_sync(_write_files, building, files)
+        await run_sync(_write_files, building, [], (), {
+            'page_token': response['startPageToken'], 'crawled_at': _now(), 'synced_at': _now(),
+        })
+        await run_sync(os.replace, building, path)
+    finally:
+        await run_sync(building.unlink, True)
+
+
+async def sync(service, user_id: str):
+    path = index_path(user_id)
+    lock = _sync_locks.get(user_id)
+    if lock is None:
+        lock = _sync_locks[user_id] = asyncio.Lock()
+    async with lock:
+        meta = await run_sync(_read_meta, path)
+        synced_at = datetime.fromisoformat(meta['synced_at'])
+        if (datetime.now(timezone.utc) - synced_at).total_seconds() < SEARCH_INDEX_SYNC_INTERVAL:
+            return meta['synced_at']
+        page_token = meta['page_token']
+        while page_token:
+            response = await execute(
+                service.changes().list(pageToken=page_token, pageSize=1000, fields=CHANGE_FIELDS),
+            )
+            files, removed_ids = [], []
+            for change in response.get('changes', []):
+                file = change.get('file')
+                if change.get('removed') or not file or file.get('trashed'):
+                    removed_ids.append(change['fileId'])
+                else:
+                    files.append(file)
+            page_token = response.get('nextPageToken')
+            meta = {'page_token': page_token or response['newStartPageToken'], 'synced_at': _now()}
+            await run_sync(_write_files, path, files, removed_ids, meta)
+        return meta['synced_at']
+
+
+def start_crawl(service, user_id: str):
+    task = _crawls.get(user_id)
+    if task is None or task.done():
+        task = _crawls[user_id] = asyncio.create_task(_locked_crawl(service, user_id))
+        task.add_done_callback(_log_crawl_failure)
+
+
+def _log_crawl_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error('Search index crawl failed', exc_info=task.exception())
+
+
+async def _extend_lock(lock_key: str):
+    while True:
+        await asyncio.sleep(CRAWL_LOCK_TTL / 3)
+        await redis.expire(lock_key, CRAWL_LOCK_TTL)
+
+
+async def _locked_crawl(service, user_id: str):
+    # Only one worker process crawls a given user at a time.
+    lock_key, token = f'search-index:{user_id}:crawl', uuid.uuid4().hex
+    if not await redis.set(lock_key, token, nx=True, ex=CRAWL_LOCK_TTL):
+        return
+    extender = asyncio.create_task(_extend_lock(lock_key))
+    try:
+        await crawl(service, user_id)
+    finally:
+        extender.cancel()
+        # Released only if it is still ours.
+        await redis.eval(RELEASE_LOCK, 1, lock_key, token)
+
+
+async def wait_for_index(service, user_id: str):
+    # For callers that cannot fall back to Drive; the crawl may be running in another worker process.
+    path = index_path(user_id)
+    while not await run_sync(path.exists):
+        start_crawl(service, user_id)
+        task = _crawls[user_id]
+        await asyncio.wait([task])
+        if not task.cancelled() and task.exception():
+            raise task.exception()
+        if not await run_sync(path.exists):
+            await asyncio.sleep(CRAWL_POLL_INTERVAL)
+
+
+async def remove_files(user_id: str, file_ids: list[str]):
+    # Drops files the app itself trashed, ahead of the change feed reporting them.
+    await run_sync(_write_files, index_path(user_id), [], file_ids)
+
+
+async def ready_index(credentials: Credentials | None, user_key: str) -> tuple | None:
+    service = get_service(credentials)
+    user_id = await cache.drive_user_id(user_key, service)
+    if not index_path(user_id).exists():
+        start_crawl(service, user_id)
+        return None
+    return service, user_id
+
+
+async def search(
+        credentials: Credentials | None, user_key: str, text: str | None = None, mode: str = 'substring',
+        parent: str | None = None, mime_type: str | None = None, min_size: int | None = None,
+        max_size: int | None = None, page_size: int = 10, cursor: str | None = None,
+) -> Page | None:
+    if cursor and not cursor.startswith(CURSOR_PREFIX):
+        return None
+    index = await ready_index(credentials, user_key)
+    if index is None:
+        return None
+    service, user_id = index
+    indexed_at = await sync(service, user_id)
+    if text is None and parent is None and mime_type is None:
+        # Like the live search, a search without terms lists folders.
+        mime_type = FOLDER_MIME_TYPE
+    offset = int(cursor[len(CURSOR_PREFIX):]) if cursor else 0
+    files = await run_sync(
+        _search, index_path(user_id), text, mode, parent, mime_type, min_size, max_size, page_size + 1, offset,
+    )
+    next_cursor = f'{CURSOR_PREFIX}{offset + page_size}' if len(files) > page_size else None
+    return Page(files[:page_size], next_cursor, indexed_at)
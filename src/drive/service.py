@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import Resource, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest
+
+from src.config import DRIVE_HTTP_TIMEOUT, DRIVE_ROOT_URL
+from src.metrics import drive_endpoint, observe_drive_call
+
+DISCOVERY_DOCUMENT = json.loads(get_static_doc('drive', 'v3'))
+if DRIVE_ROOT_URL:
+    # Upload and batch URLs are derived from rootUrl, so the document is rewritten rather than the endpoint.
+    root_url = DRIVE_ROOT_URL.rstrip('/') + '/'
+    DISCOVERY_DOCUMENT.update(
+        rootUrl=root_url, mtlsRootUrl=root_url, baseUrl=f'{root_url}{DISCOVERY_DOCUMENT["servicePath"]}',
+    )
+
+
+def _body_size(body, kwargs: dict) -> int:
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    # Upload chunks are file slices; their size is in the Content-Length header.
+    headers = {name.lower(): value for name, value in (kwargs.get('headers') or {}).items()}
+    return int(headers.get('content-length', 0))
+
+
+# httplib2.Http is not thread-safe, so every executor thread keeps its own keep-alive connections.
+class ThreadLocalHttp:
+
+    def __init__(self, timeout: int | None = None):
+        self._timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def http(self) -> httplib2.Http:
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = httplib2.Http(timeout=self._timeout)
+            # Drive answers unfinished resumable upload chunks with 308, which is not a redirect here.
+            http.redirect_codes = http.redirect_codes - {308}
+        return http
+
+    def request(self, uri, method='GET', body=None, *args, **kwargs):
+        started = time.perf_counter()
+        status, content = 'error', b''
+        try:
+            response, content = self.http.request(uri, method, body, *args, **kwargs)
+            status = response.status
+            return response, content
+        finally:
+            elapsed = time.perf_counter() - started
+            sent, received = _body_size(body, kwargs), len(content or b'')
+            observe_drive_call(drive_endpoint(method, uri), status, elapsed, sent, received)
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+
+transport = ThreadLocalHttp(timeout=DRIVE_HTTP_TIMEOUT)
+
+# The resource tree is built once per process; generating its methods costs milliseconds per resource.
+# Requests created from it are bound to the caller's credentials in BoundResource.
+root_resource = build_from_document(DISCOVERY_DOCUMENT, http=transport)
+_nested_resources: dict[str, Resource] = {}
+
+
+def nested_resource(name: str) -> Resource:
+    resource = _nested_resources.get(name)
+    if resource is None:
+        resource = _nested_resources.setdefault(name, getattr(root_resource, name)())
+    return resource
+
+
+class BoundResource:
+
+    def __init__(self, resource: Resource, http: AuthorizedHttp):
+        self._resource = resource
+        self._http = http
+
+    def __getattr__(self, name):
+        if self._resource is root_resource and name in DISCOVERY_DOCUMENT['resources']:
+            return lambda: BoundResource(nested_resource(name), self._http)
+        method = getattr(self._resource, name)
+
+        def bound(*args, **kwargs):
+            result = method(*args, **kwargs)
+            if isinstance(result, HttpRequest):
+                result.http = self._http
+            elif isinstance(result, Resource):
+                result = BoundResource(result, self._http)
+            return result
+        return bound
+
+
+def authorized_http(credentials: Credentials | None) -> AuthorizedHttp:
+    return AuthorizedHttp(credentials, http=transport)
+
+
+def get_service(credentials: Credentials | None) -> BoundResource:
+    return BoundResource(root_resource, authorized_http(credentials))
@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+from datetime import datetime, timezone
+from pathlib import Path
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.http import MediaIoBaseUpload
+
+from src.auth.credentials import get_credentials
+from src.config import (
+    DOWNLOAD_CHUNK_SIZE, PAGE_SIZE, SYNC_BANDWIDTH, SYNC_CONCURRENCY, SYNC_MANIFEST_DIR, UPLOAD_CHUNK_SIZE,
+)
+from src.drive import bulk, cache, drive, upstream
+from src.drive.executor import run_sync
+from src.drive.models import FOLDER_MIME_TYPE, listing_fields, parse_time
+from src.drive.service import get_service
+
+HASH_CHUNK_SIZE = 1024 * 1024
+TEMPORARY_SUFFIX = '.drive-sync.tmp'
+
+
+def manifest_path(root: Path, folder_id: str) -> Path:
+    return Path(SYNC_MANIFEST_DIR, hashlib.sha1(f'{root}:{folder_id}'.encode()).hexdigest() + '.json')
+
+
+def _read_manifest(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(path: Path, manifest: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(TEMPORARY_SUFFIX)
+    temporary.write_text(json.dumps(manifest))
+    os.replace(temporary, path)
+
+
+def _local_tree(root: Path) -> tuple[dict[str, tuple[int, int]], set[str]]:
+    # Relative POSIX paths, so they compare directly with paths built from Drive names.
+    files, folders = {}, set()
+    for directory, dirnames, filenames in os.walk(root):
+        relative = Path(directory).relative_to(root).as_posix()
+        relative = '' if relative == '.' else relative
+        folders.update(posixpath.join(relative, name) for name in dirnames)
+        for name in filenames:
+            if name.endswith(TEMPORARY_SUFFIX):
+                continue
+            stat = os.stat(os.path.join(directory, name))
+            files[posixpath.join(relative, name)] = (stat.st_size, stat.st_mtime_ns)
+    return files, folders
+
+
+def _representable(name: str) -> bool:
+    # Names that would not map onto a single path component, as in archive._safe_name.
+    return name not in ('', '.', '..') and '/' not in name and '\\' not in name
+
+
+def _inside(root: Path, path: str) -> bool:
+    # Resolved, so a symlink under the root cannot redirect a write outside of it.
+    return (root / path).resolve().is_relative_to(root)
+
+
+def _make_folder(root: Path, path: str) -> bool:
+    if not _inside(root, path):
+        return False
+    (root / path).mkdir(parents=True, exist_ok=True)
+    return True
+
+
+def _prepare_download(root: Path, path: str) -> bool:
+    # The temporary file is written through, the target is only replaced, so only the former must resolve inside.
+    return _make_folder(root, posixpath.dirname(path)) and _inside(root, path + TEMPORARY_SUFFIX)
+
+
+def _md5(path: Path) -> str:
+    digest = hashlib.md5()
+    with open(path, 'rb') as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _rfc3339(mtime_ns: int) -> str:
+    modified = datetime.fromtimestamp(mtime_ns / 10 ** 9, timezone.utc)
+    return modified.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def _same_second(mtime_ns: int, modified_time: str | None) -> bool:
+    return modified_time is not None and mtime_ns // 10 ** 9 == int(parse_time(modified_time).timestamp())
+
+
+class Sync:
+
+    def __init__(
+            self, credentials: Credentials | None, root: Path, folder_id: str, user_key: str | None = None,
+            delete: bool = False, dry_run: bool = False, bandwidth: int = SYNC_BANDWIDTH, progress=None,
+    ):
+        self.service = get_service(credentials)
+        self.credentials = credentials
+        self.root = Path(root).resolve()
+        self.folder_id = folder_id
+        self.user_key = user_key
+        self.delete = delete
+        self.dry_run = dry_run
+        self.progress = progress
+        # One byte budget shared by all transfers. It holds a whole chunk, since larger costs are clamped,
+        # but starts empty so the cap holds from the first byte.
+        self.limiter = None
+        if bandwidth:
+            self.limiter = upstream.TokenBucket(bandwidth, max(bandwidth, UPLOAD_CHUNK_SIZE, DOWNLOAD_CHUNK_SIZE))
+            self.limiter.tokens = 0
+        self.slots = asyncio.Semaphore(SYNC_CONCURRENCY)
+        self.manifest_path = manifest_path(self.root, folder_id)
+        self.previous = {}
+        self.manifest = {}
+        self.touched_folders = set()
+        self.report = {
+            'direction': None, 'dry_run': dry_run, 'uploaded': [], 'updated': [], 'downloaded': [],
+            'folders_created': [], 'deleted': [], 'unchanged': 0, 'bytes': 0, 'errors': {},
+        }
+
+    async def _transferred(self, size: int):
+        if self.limiter:
+            await self.limiter.acquire(size)
+        self.report['bytes'] += size
+        if self.progress:
+            await self.progress(size)
+
+    async def _list_folder(self, folder_id: str) -> list[dict]:
+        async with self.slots:
+            files = drive.iter_files(self.service, drive.folder_query(folder_id), PAGE_SIZE, listing_fields('sync'))
+            return [file async for file in files]
+
+    async def _remote_tree(self) -> tuple[dict[str, dict], dict[str, str]]:
+        # Level by level, listing the folders of one level concurrently.
+        files, folders = {}, {'': self.folder_id}
+        level = [('', self.folder_id)]
+        while level:
+            listings = await asyncio.gather(*(self._list_folder(folder_id) for _, folder_id in level))
+            next_level = []
+            for (prefix, _), children in zip(level, listings):
+                for child in children:
+                    path = posixpath.join(prefix, child['name'])
+                    if not _representable(child['name']) or path in files or path in folders:
+                        # Not representable on disk, or a duplicate name: the first one listed wins.
+                        continue
+                    if child['mimeType'] == FOLDER_MIME_TYPE:
+                        folders[path] = child['id']
+                        next_level.append((path, child['id']))
+                    else:
+                        files[path] = child
+            level = next_level
+        return files, folders
+
+    async def _local_md5(self, path: str, stat: tuple[int, int]) -> str:
+        # A file whose size and mtime match the manifest is not read again.
+        size, mtime_ns = stat
+        entry = self.previous.get(path)
+        if entry and entry['size'] == size and entry['mtime_ns'] == mtime_ns:
+            md5 = entry['md5']
+        else:
+            async with self.slots:
+                md5 = await run_sync(_md5, self.root / path)
+        self.manifest[path] = {'size': size, 'mtime_ns': mtime_ns, 'md5': md5}
+        return md5
+
+    async def _unchanged(self, path: str, stat: tuple[int, int], remote: dict) -> bool:
+        size, mtime_ns = stat
+        if 'md5Checksum' not in remote or int(remote.get('size', -1)) != size:
+            return False
+        if _same_second(mtime_ns, remote.get('modifiedTime')):
+            # Same size and modification time: trusted without hashing, like rsync's quick check.
+            self.manifest[path] = {'size': size, 'mtime_ns': mtime_ns, 'md5': remote['md5Checksum']}
+            return True
+        return await self._local_md5(path, stat) == remote['md5Checksum']
+
+    async def _ensure_folders(self, paths, folders: dict[str, str]):
+        # Parents sort before their children, so every parent exists by the time a child is created.
+        for path in sorted(paths, key=lambda path: path.count('/')):
+            if path in folders:
+                continue
+            parent, name = posixpath.split(path)
+            self.report['folders_created'].append(path)
+            if self.dry_run:
+                folders[path] = None
+                continue
+            folder = await drive.make_folder(self.service, name, folders[parent], self.user_key)
+            folders[path] = folder['id']
+
+    async def _upload(self, path: str, stat: tuple[int, int], parent_id: str, remote: dict | None):
+        size, mtime_ns = stat
+        body = {'modifiedTime': _rfc3339(mtime_ns)}
+        if not remote:
+            body.update(name=posixpath.basename(path), parents=[parent_id])
+        file = await run_sync(open, self.root / path, 'rb')
+        try:
+            media = MediaIoBaseUpload(
+                file, mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream',
+                chunksize=UPLOAD_CHUNK_SIZE, resumable=True,
+            )
+            files = self.service.files()
+            if remote:
+                request = files.update(fileId=remote['id'], body=body, media_body=media, fields='id, md5Checksum')
+            else:
+                request = files.create(body=body, media_body=media, fields='id, md5Checksum')
+            result = await drive.upload_media(request, self._transferred)
+        finally:
+            await run_sync(file.close)
+        self.touched_folders.add(parent_id)
+        if 'md5Checksum' in result:
+            self.manifest[path] = {'size': size, 'mtime_ns': mtime_ns, 'md5': result['md5Checksum']}
+
+    async def _download(self, path: str, remote: dict):
+        target = self.root / path
+        temporary = target.with_name(target.name + TEMPORARY_SUFFIX)
+        if not await run_sync(_prepare_download, self.root, path):
+            raise ValueError(f'{path} is outside the sync root')
+        file = await run_sync(open, temporary, 'wb')
+        try:
+            async for chunk in drive.iter_file_content(self.credentials, remote['id']):
+                await run_sync(file.write, chunk)
+                await self._transferred(len(chunk))
+            await run_sync(file.close)
+        except BaseException:
+            await run_sync(file.close)
+            await run_sync(temporary.unlink, True)
+            raise
+        # The remote modifiedTime becomes the local mtime, so the next run's quick check matches.
+        mtime_ns = int(parse_time(remote['modifiedTime']).timestamp() * 10 ** 9)
+        await run_sync(os.utime, temporary, ns=(mtime_ns, mtime_ns))
+        await run_sync(os.replace, temporary, target)
+        self.manifest[path] = {'size': int(remote['size']), 'mtime_ns': mtime_ns, 'md5': remote['md5Checksum']}
+
+    async def _guarded(self, path: str, transfer):
+        try:
+            async with self.slots:
+                await transfer
+        except Exception as error:
+            self.report['errors'][path] = f'An error occurred: {error}'
+            self.manifest.pop(path, None)
+
+    async def _compare(self, paths, local: dict, remote_files: dict) -> list[str]:
+        async def check(path):
+            remote, stat = remote_files.get(path), local.get(path)
+            return path, bool(remote and stat) and await self._unchanged(path, stat, remote)
+        changed = []
+        for path, unchanged in await asyncio.gather(*(check(path) for path in paths)):
+            if unchanged:
+                self.report['unchanged'] += 1
+            else:
+                changed.append(path)
+        return changed
+
+    async def push(self) -> dict:
+        self.report['direction'] = 'push'
+        local, local_folders = await run_sync(_local_tree, self.root)
+        remote_files, folders = await self._remote_tree()
+        changed = await self._compare(local, local, remote_files)
+        if self.progress:
+            self.progress.total = sum(local[path][0] for path in changed)
+        await self._ensure_folders(local_folders | {posixpath.dirname(path) for path in changed}, folders)
+
+        transfers = []
+        for path in changed:
+            remote = remote_files.get(path)
+            self.report['updated' if remote else 'uploaded'].append(path)
+            if not self.dry_run:
+                parent_id = folders[posixpath.dirname(path)]
+                transfers.append(self._guarded(path, self._upload(path, local[path], parent_id, remote)))
+        await asyncio.gather(*transfers)
+
+        extra = sorted(set(remote_files) - set(local))
+        if self.delete and extra:
+            self.report['deleted'] = extra
+            if not self.dry_run:
+                # Trashed rather than deleted, so a wrong sync root can still be undone from the Drive trash.
+                paths = {remote_files[path]['id']: path for path in extra}
+                report = await bulk.bulk_operation(self.credentials, 'trash', list(paths), user_key=self.user_key)
+                for item in report:
+                    if item['status'] == 'error':
+                        self.report['errors'][paths[item['id']]] = item['error']
+        await cache.invalidate(self.user_key, folder_ids=self.touched_folders)
+        return await self._finish()
+
+    async def pull(self) -> dict:
+        self.report['direction'] = 'pull'
+        local, _ = await run_sync(_local_tree, self.root)
+        remote_files, folders = await self._remote_tree()
+        # Google Docs have no bytes of their own to mirror; exports cover those.
+        remote_files = {path: file for path, file in remote_files.items() if 'md5Checksum' in file}
+        changed = await self._compare(remote_files, local, remote_files)
+        if self.progress:
+            self.progress.total = sum(int(remote_files[path]['size']) for path in changed)
+
+        for path in sorted(folders):
+            if path and not self.dry_run and not await run_sync(_make_folder, self.root, path):
+                self.report['errors'][path] = 'An error occurred: the folder is outside the sync root'
+        transfers = []
+        for path in changed:
+            self.report['updated' if path in local else 'downloaded'].append(path)
+            if not self.dry_run:
+                transfers.append(self._guarded(path, self._download(path, remote_files[path])))
+        await asyncio.gather(*transfers)
+
+        extra = sorted(set(local) - set(remote_files))
+        if self.delete and extra:
+            self.report['deleted'] = extra
+            if not self.dry_run:
+                for path in extra:
+                    await run_sync((self.root / path).unlink, True)
+                    self.manifest.pop(path, None)
+        return await self._finish()
+
+    async def _finish(self) -> dict:
+        if not self.dry_run:
+            await run_sync(_write_manifest, self.manifest_path, {'folder_id': self.folder_id, 'files': self.manifest})
+        return self.report
+
+    async def run(self, direction: str = 'push') -> dict:
+        if not self.root.is_dir():
+            raise NotADirectoryError(f'{self.root} is not a directory')
+        manifest = await run_sync(_read_manifest, self.manifest_path)
+        self.previous = manifest.get('files', {})
+        return await (self.push() if direction == 'push' else self.pull())
+
+
+async def sync(
+        credentials: Credentials | None, root: Path, folder_id: str, direction: str = 'push',
+        user_key: str | None = None, delete: bool = False, dry_run: bool = False, progress=None,
+) -> dict:
+    return await Sync(credentials, root, folder_id, user_key, delete, dry_run, progress=progress).run(direction)
+
+
+async def _main(args):
+    credentials = await get_credentials(args.session)
+    if not credentials:
+        raise SystemExit('No credentials for that session; log in through the web app first.')
+    report = await Sync(
+        credentials, Path(args.local), args.folder_id, args.session, args.delete, args.dry_run, args.bandwidth,
+    ).run(args.direction)
+    print(json.dumps(report, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mirror a local directory into a Drive folder, or the reverse')
+    parser.add_argument('local', help='Local directory')
+    parser.add_argument('folder_id', help='Drive folder id')
+    parser.add_argument('--session', required=True, help='session_id cookie of a logged in session')
+    parser.add_argument('--direction', choices=['push', 'pull'], default='push')
+    parser.add_argument('--delete', action='store_true', help='Remove files missing on the source side')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without transferring')
+    parser.add_argument('--bandwidth', type=int, default=SYNC_BANDWIDTH, help='Bytes per second, 0 for no cap')
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
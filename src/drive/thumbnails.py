@@ -0,0 +1,177 @@
+import asyncio
+import os
+import re
+import tempfile
+from functools import partial
+from pathlib import Path
+from urllib.parse import urlencode
+
+from fastapi import exceptions
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+from starlette import status
+
+from src.config import (
+    PAGE_SIZE, THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_CONCURRENCY, THUMBNAIL_MAX_SOURCE_SIZE,
+    THUMBNAIL_QUALITY,
+)
+from src.drive import blob_cache, cache, drive, images, upstream
+from src.drive.executor import run_in_process, run_sync
+from src.drive.models import FIELD_MASKS, listing_fields
+from src.drive.service import authorized_http, get_service
+
+THUMBNAIL_FIELDS = FIELD_MASKS['thumbnail']
+THUMBNAIL_LISTING_FIELDS = listing_fields('thumbnail')
+# Drive renders a thumbnail at whatever size the =s suffix of its link asks for.
+LINK_SIZE = re.compile(r'=s\d+$')
+MIN_SIZE = 16
+MAX_SIZE = 1024
+
+_slots = asyncio.Semaphore(THUMBNAIL_CONCURRENCY)
+
+
+def revision(file: dict) -> str | None:
+    # Binary files change md5Checksum with their content; Google Docs have none, but bump version on every edit.
+    return file.get('md5Checksum') or file.get('version')
+
+
+def thumbnail_path(file: dict, size: int, image_format: str) -> Path | None:
+    file_revision = revision(file)
+    if not file_revision:
+        return None
+    return Path(THUMBNAIL_CACHE_DIR, file['id'], f'{size}.{file_revision}.{image_format}')
+
+
+def thumbnail_url(file_id: str, size: int, image_format: str) -> str:
+    return f'/drive/thumbnail?{urlencode({"file_id": file_id, "size": size, "format": image_format})}'
+
+
+def _resizable(file: dict) -> bool:
+    return file['mimeType'].startswith('image/') and int(file.get('size', 0)) <= THUMBNAIL_MAX_SOURCE_SIZE
+
+
+def previewable(file: dict) -> bool:
+    return bool(file.get('thumbnailLink')) or _resizable(file)
+
+
+def _lookup(path: Path) -> bool | None:
+    # None when nothing is cached; an empty file records that no preview can be made for this revision.
+    # A hit touches the file, since the modification time is its last access for eviction.
+    try:
+        os.utime(path)
+        return path.stat().st_size > 0
+    except FileNotFoundError:
+        return None
+
+
+def _store(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f'{path.name}.', suffix='.tmp', delete=False) as file:
+        file.write(data)
+    os.replace(file.name, path)
+    size, _, image_format = path.name.split('.')
+    for stale in path.parent.glob(f'{size}.*.{image_format}'):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+    blob_cache.evict_lru(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, path)
+
+
+def _download(http, uri: str) -> bytes:
+    response, content = http.request(uri, method='GET')
+    if response.status >= 300:
+        raise HttpError(response, content, uri=uri)
+    return content
+
+
+async def _source(credentials: Credentials | None, service, file: dict, size: int) -> bytes | None:
+    link = file.get('thumbnailLink')
+    if link:
+        http = authorized_http(credentials)
+        try:
+            return await upstream.call(_download, http, LINK_SIZE.sub(f'=s{size}', link), user=upstream.user_of(http))
+        except HttpError:
+            # Drive has not rendered it yet or the link has expired; an image can still be resized here.
+            if not _resizable(file):
+                raise
+    if not _resizable(file):
+        return None
+    blob = await blob_cache.lookup(file)
+    if blob:
+        return await run_sync(blob.read_bytes)
+    chunks = drive.iter_media(service.files().get_media(fileId=file['id']))
+    return b''.join([chunk async for chunk in chunks])
+
+
+async def _render(credentials: Credentials | None, service, file: dict, size: int, image_format: str, path: Path):
+    try:
+        source = await _source(credentials, service, file, size)
+    except HttpError:
+        # Not recorded, so the next request tries again.
+        return False
+    data = None
+    if source:
+        # Decoding and resizing hold the GIL, so they run in a worker process instead of an executor thread.
+        data = await run_in_process(images.thumbnail, source, size, image_format, THUMBNAIL_QUALITY)
+    await run_sync(_store, path, data or b'')
+    return bool(data)
+
+
+async def render(
+        credentials: Credentials | None, service, file: dict, size: int, image_format: str,
+) -> Path | None:
+    # file carries THUMBNAIL_FIELDS; concurrent requests for the same thumbnail share one rendering.
+    path = thumbnail_path(file, size, image_format)
+    if path is None:
+        return None
+    found = await run_sync(_lookup, path)
+    if found is None:
+        found = await upstream.coalesce(
+            ('thumbnail', path), partial(_render, credentials, service, file, size, image_format, path),
+        )
+    return path if found else None
+
+
+async def thumbnail_target(credentials: Credentials | None, file_id: str, user_key: str | None = None):
+    service = get_service(credentials)
+    await cache.sync_changes(user_key, service)
+    try:
+        file = await drive.cached_file_metadata(service, file_id, user_key)
+    except HttpError as error:
+        raise exceptions.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'An error occurred: {error}')
+    return service, file
+
+
+async def thumbnail(
+        credentials: Credentials | None, service, file: dict, size: int, image_format: str,
+) -> Path | None:
+    path = thumbnail_path(file, size, image_format)
+    if path and await run_sync(_lookup, path) is None:
+        # The cached metadata has the revision but no thumbnailLink, which is only fetched on a miss.
+        file = await upstream.execute(service.files().get(fileId=file['id'], fields=THUMBNAIL_FIELDS))
+    return await render(credentials, service, file, size, image_format)
+
+
+async def render_page(
+        credentials: Credentials | None, folder_id: str | None, size: int, image_format: str,
+        user_key: str | None = None, cursor: str | None = None, page_size: int = PAGE_SIZE, progress=None,
+) -> dict:
+    # One listing call returns the revisions and thumbnail links of a whole page.
+    service = get_service(credentials)
+    await cache.sync_changes(user_key, service)
+    folder = await drive.cached_file_metadata(service, folder_id or 'root', user_key)
+    page = await drive.list_page(
+        service, drive.folder_query(folder['id']), cursor, page_size, THUMBNAIL_LISTING_FIELDS,
+    )
+    files = [file for file in page.files if previewable(file)]
+    if progress:
+        progress.total = len(files)
+
+    async def render_one(file: dict):
+        async with _slots:
+            path = await render(credentials, service, file, size, image_format)
+        if progress:
+            await progress(1)
+        return file['id'], thumbnail_url(file['id'], size, image_format) if path else None
+
+    thumbnails = await asyncio.gather(*(render_one(file) for file in files))
+    return {'thumbnails': dict(thumbnails), 'next_cursor': page.next_cursor}
@@ -0,0 +1,202 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import httplib2
+from cachetools import LRUCache
+from googleapiclient.errors import HttpError
+
+from src.config import (
+    CREDENTIALS_CACHE_SIZE, DRIVE_BREAKER_COOLDOWN, DRIVE_BREAKER_THRESHOLD, DRIVE_MAX_RETRIES, DRIVE_USER_BURST,
+    DRIVE_USER_RATE,
+)
+from src.drive.executor import run_sync
+from src.metrics import DRIVE_COALESCED, DRIVE_RETRIES
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+TRANSPORT_ERRORS = (OSError, httplib2.HttpLib2Error)
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 32
+
+
+class UpstreamUnavailable(Exception):
+    # Raised once Drive keeps throttling or failing after every retry, or while the circuit breaker is open.
+
+    def __init__(self, status_code: int, retry_after: float, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+def is_rate_limited(error: Exception) -> bool:
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    return error.resp.status == 403 and b'ratelimitexceeded' in (error.content or b'').lower()
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (UpstreamUnavailable, *TRANSPORT_ERRORS)):
+        return True
+    return isinstance(error, HttpError) and (error.resp.status in RETRYABLE_STATUSES or is_rate_limited(error))
+
+
+def not_applied(error: Exception) -> bool:
+    # Throttled or refused before the connection was made: Drive did not act on it, so even a create can be resent.
+    return is_rate_limited(error) or isinstance(error, ConnectionRefusedError)
+
+
+def retry_after(error: Exception) -> float | None:
+    if isinstance(error, UpstreamUnavailable):
+        return error.retry_after
+    value = error.resp.get('retry-after') if isinstance(error, HttpError) else None
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int, error: Exception | None = None) -> float:
+    # Full jitter spreads retries of many clients over the window; the server's Retry-After is a lower bound.
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    return max(delay, (retry_after(error) if error else None) or 0)
+
+
+class TokenBucket:
+    # Drive's quota is per user; each bucket halves its rate on a rate-limit error and creeps back on success.
+
+    def __init__(self, rate: float, capacity: int):
+        self.max_rate = self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, cost: int = 1):
+        cost = min(cost, self.capacity)
+        self._refill()
+        while self.tokens < cost:
+            await asyncio.sleep((cost - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= cost
+
+    def slow_down(self):
+        self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def speed_up(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class CircuitBreaker:
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    def check(self):
+        if self.opened_at is None:
+            return
+        remaining = self.opened_at + self.cooldown - time.monotonic()
+        if remaining > 0:
+            raise UpstreamUnavailable(503, remaining, 'Google Drive is unavailable, try again later')
+        # Half-open: this call is the probe, everyone else waits for another cooldown.
+        self.opened_at = time.monotonic()
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(DRIVE_BREAKER_THRESHOLD, DRIVE_BREAKER_COOLDOWN)
+_buckets: LRUCache = LRUCache(maxsize=CREDENTIALS_CACHE_SIZE)
+_in_flight: dict[tuple, asyncio.Future] = {}
+
+
+def user_of(http) -> str | None:
+    # Keyed by access token, like the upload slots; a refreshed token just starts a fresh bucket.
+    credentials = getattr(http, 'credentials', None)
+    return getattr(credentials, 'token', None)
+
+
+def bucket(user: str | None) -> TokenBucket:
+    user_bucket = _buckets.get(user)
+    if user_bucket is None:
+        user_bucket = _buckets[user] = TokenBucket(DRIVE_USER_RATE, DRIVE_USER_BURST)
+    return user_bucket
+
+
+async def call(
+        func, *args, user: str | None = None, retries: int = DRIVE_MAX_RETRIES, cost: int = 1, idempotent: bool = True,
+        **kwargs,
+):
+    # Runs a blocking Drive call in the executor under the user's rate limit, the circuit breaker and retries.
+    # A call that is not idempotent is only retried when Drive certainly did not apply it.
+    user_bucket = bucket(user)
+    attempt = 0
+    while True:
+        breaker.check()
+        await user_bucket.acquire(cost)
+        try:
+            result = await run_sync(func, *args, **kwargs)
+        except (HttpError, *TRANSPORT_ERRORS) as error:
+            if is_rate_limited(error):
+                user_bucket.slow_down()
+            elif is_retryable(error):
+                breaker.failure()
+            else:
+                # Drive answered, the request itself is wrong.
+                breaker.success()
+                raise
+            if attempt >= retries or not (idempotent or not_applied(error)):
+                status_code = 429 if is_rate_limited(error) else 503
+                delay = retry_after(error) or backoff(attempt + 1)
+                raise UpstreamUnavailable(status_code, delay, f'Google Drive request failed: {error}') from error
+            attempt += 1
+            DRIVE_RETRIES.labels('rate_limit' if is_rate_limited(error) else 'error').inc()
+            await asyncio.sleep(backoff(attempt, error))
+            continue
+        breaker.success()
+        user_bucket.speed_up()
+        return result
+
+
+async def execute(request, retries: int = DRIVE_MAX_RETRIES):
+    # A POST that timed out may still have created its file; resending it would make a second one.
+    idempotent = request.method != 'POST'
+    return await call(request.execute, user=user_of(request.http), retries=retries, idempotent=idempotent)
+
+
+def _forget(key: tuple, task: asyncio.Future):
+    _in_flight.pop(key, None)
+    # Retrieve the outcome so an error nobody waited for is not reported as never retrieved.
+    if not task.cancelled():
+        task.exception()
+
+
+async def coalesce(key: tuple, factory):
+    # Concurrent identical reads share one in-flight call; a caller going away does not cancel it for the others.
+    task = _in_flight.get(key)
+    if task is None:
+        task = _in_flight[key] = asyncio.ensure_future(factory())
+        task.add_done_callback(lambda done: _forget(key, done))
+    else:
+        DRIVE_COALESCED.inc()
+    return await asyncio.shield(task)
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from collections import defaultdict
+
+from google.oauth2.credentials import Credentials
+
+from src.config import PAGE_SIZE, WALKER_CONCURRENCY
+from src.drive import cache
+from src.drive.drive import cached_file_metadata, cached_folder_listing, folder_query, list_page
+from src.drive.models import FOLDER_MIME_TYPE
+from src.drive.service import get_service
+
+STATS_EMIT_INTERVAL = 1
+LARGEST_SUBTREES = 10
+
+_done = object()
+
+
+async def walk(
+        service, folder_id: str, user_key: str | None = None, concurrency: int = WALKER_CONCURRENCY,
+        fields: str | None = None,
+):
+    # Breadth-first: every listed page is yielded as (folder_id, files) and its subfolders are queued.
+    # Cached listings carry the browse fields only, so a walk that needs other fields lists uncached.
+    folders = asyncio.Queue()
+    folders.put_nowait(folder_id)
+    results = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while True:
+            current_id = await folders.get()
+            try:
+                cursor = None
+                while True:
+                    if fields:
+                        page = await list_page(service, folder_query(current_id), cursor, PAGE_SIZE, fields)
+                    else:
+                        page = await cached_folder_listing(service, current_id, user_key, cursor)
+                    # A page is always yielded before the listings of its subfolders.
+                    await results.put((current_id, page.files))
+                    for file in page.files:
+                        if file['mimeType'] == FOLDER_MIME_TYPE:
+                            folders.put_nowait(file['id'])
+                    cursor = page.next_cursor
+                    if not cursor:
+                        break
+            except Exception as error:
+                await results.put((current_id, error))
+            finally:
+                folders.task_done()
+
+    async def finish():
+        await folders.join()
+        await results.put(_done)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    tasks.append(asyncio.create_task(finish()))
+    try:
+        while (item := await results.get()) is not _done:
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class FolderStats:
+
+    def __init__(self, folder_id: str):
+        self.folder_id = folder_id
+        self.total_bytes = 0
+        self.file_count = 0
+        self.folder_count = 0
+        self.errors = {}
+        self.mime_types = defaultdict(lambda: {'count': 0, 'bytes': 0})
+        self.folder_bytes = defaultdict(int)
+        self.folder_names = {}
+        self.parents = {}
+
+    def add(self, folder_id: str, files: list[dict]):
+        for file in files:
+            if file['mimeType'] == FOLDER_MIME_TYPE:
+                self.folder_count += 1
+                self.folder_names[file['id']] = file['name']
+                self.parents[file['id']] = folder_id
+                continue
+            size = int(file.get('size', 0))
+            self.file_count += 1
+            self.total_bytes += size
+            self.folder_bytes[folder_id] += size
+            self.mime_types[file['mimeType']]['count'] += 1
+            self.mime_types[file['mimeType']]['bytes'] += size
+
+    def largest_subtrees(self, limit: int = LARGEST_SUBTREES) -> list[dict]:
+        subtree_bytes = defaultdict(int)
+        for folder_id, size in self.folder_bytes.items():
+            while folder_id in self.parents:
+                subtree_bytes[folder_id] += size
+                folder_id = self.parents[folder_id]
+        largest = sorted(subtree_bytes.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [
+            {'id': folder_id, 'name': self.folder_names[folder_id], 'bytes': size} for folder_id, size in largest
+        ]
+
+    def as_dict(self, done: bool = False) -> dict:
+        return {
+            'folder_id': self.folder_id,
+            'done': done,
+            'total_bytes': self.total_bytes,
+            'file_count': self.file_count,
+            'folder_count': self.folder_count,
+            'mime_types': dict(self.mime_types),
+            'largest_subtrees': self.largest_subtrees(),
+            'errors': self.errors,
+        }
+
+
+async def folder_stats(credentials: Credentials | None, folder_id: str | None = None, user_key: str | None = None):
+    service = get_service(credentials)
+    await cache.sync_changes(user_key, service)
+    if not folder_id:
+        folder_id = (await cached_file_metadata(service, 'root', user_key))['id']
+    stats = FolderStats(folder_id)
+    emitted_at = time.monotonic()
+    async for current_id, files in walk(service, folder_id, user_key):
+        if isinstance(files, Exception):
+            stats.errors[current_id] = f'An error occurred: {files}'
+            continue
+        stats.add(current_id, files)
+        if time.monotonic() - emitted_at >= STATS_EMIT_INTERVAL:
+            emitted_at = time.monotonic()
+            yield stats.as_dict()
+    yield stats.as_dict(done=True)
@@ -0,0 +1,53 @@
+import copy
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+from src.config import LOG_FILE, LOG_LEVEL
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **getattr(record, 'fields', {}),
+        }
+        exception = getattr(record, 'exception', None)
+        if record.exc_info:
+            exception = self.formatException(record.exc_info)
+        if exception:
+            entry['exception'] = exception
+        return json.dumps(entry, default=str)
+
+
+class RecordQueueHandler(QueueHandler):
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare folds the traceback into the message and drops exc_info; keep it as its own field.
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exception = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.message = record.msg
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+
+def setup_logging() -> QueueListener:
+    # Request handlers only enqueue records; a listener thread formats them and does the file I/O.
+    handler = logging.FileHandler(LOG_FILE)
+    handler.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(RecordQueueHandler(records))
+    listener.start()
+    return listener
@@ -0,0 +1,112 @@
+import logging
+import os
+import re
+import time
+from urllib.parse import urlsplit
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+access_logger = logging.getLogger('access')
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests handled', ['method', 'route', 'status'])
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to the last byte of the response', ['method', 'route'],
+)
+IN_PROGRESS = Gauge('http_requests_in_progress', 'HTTP requests being handled', ['method'], multiprocess_mode='livesum')
+RECEIVED_BYTES = Counter('http_received_bytes_total', 'Request body bytes received from clients', ['route'])
+SENT_BYTES = Counter('http_sent_bytes_total', 'Response body bytes sent to clients', ['route'])
+
+DRIVE_CALLS = Counter('drive_requests_total', 'Requests made to the Drive API', ['endpoint', 'status'])
+DRIVE_LATENCY = Histogram('drive_request_duration_seconds', 'Drive API request latency', ['endpoint'])
+DRIVE_SENT_BYTES = Counter('drive_sent_bytes_total', 'Request body bytes uploaded to the Drive API', ['endpoint'])
+DRIVE_RECEIVED_BYTES = Counter(
+    'drive_received_bytes_total', 'Response bytes downloaded from the Drive API', ['endpoint'],
+)
+DRIVE_RETRIES = Counter('drive_retries_total', 'Drive calls retried after an error', ['reason'])
+DRIVE_COALESCED = Counter('drive_coalesced_requests_total', 'Drive reads that joined an identical in-flight call')
+
+# Path segments that name a Drive resource or method; anything else is an id and collapses into {id}.
+DRIVE_PATH_WORDS = {
+    'drive', 'v3', 'upload', 'batch', 'files', 'about', 'changes', 'drives', 'permissions', 'revisions', 'comments',
+    'replies', 'channels', 'startPageToken', 'trash', 'generateIds', 'watch', 'stop', 'export', 'copy', 'token',
+}
+MEDIA_QUERY = re.compile(r'(^|&)alt=media(&|$)')
+
+
+def drive_endpoint(method: str, uri: str) -> str:
+    url = urlsplit(uri)
+    path = '/'.join(segment if segment in DRIVE_PATH_WORDS else '{id}' for segment in url.path.strip('/').split('/'))
+    media = ' media' if MEDIA_QUERY.search(url.query) else ''
+    return f'{method} /{path}{media}'
+
+
+def observe_drive_call(endpoint: str, status: int | str, seconds: float, sent: int, received: int):
+    DRIVE_CALLS.labels(endpoint, str(status)).inc()
+    DRIVE_LATENCY.labels(endpoint).observe(seconds)
+    if sent:
+        DRIVE_SENT_BYTES.labels(endpoint).inc(sent)
+    if received:
+        DRIVE_RECEIVED_BYTES.labels(endpoint).inc(received)
+
+
+def render() -> tuple[bytes, str]:
+    # Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR and any worker can aggregate them.
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        method = scope['method']
+        started = time.perf_counter()
+        received, sent, status = 0, 0, 500
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get('body', b''))
+            return message
+
+        async def counting_send(message):
+            nonlocal sent, status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                sent += len(message.get('body', b''))
+            await send(message)
+
+        IN_PROGRESS.labels(method).inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            IN_PROGRESS.labels(method).dec()
+            elapsed = time.perf_counter() - started
+            # The route template, not the raw path, keeps label cardinality bounded.
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            REQUESTS.labels(method, route, str(status)).inc()
+            REQUEST_LATENCY.labels(method, route).observe(elapsed)
+            RECEIVED_BYTES.labels(route).inc(received)
+            SENT_BYTES.labels(route).inc(sent)
+            client = scope.get('client')
+            access_logger.info('request', extra={'fields': {
+                'client': client[0] if client else None,
+                'method': method,
+                'path': scope['path'],
+                'route': route,
+                'status': status,
+                'duration_ms': round(elapsed * 1000, 2),
+                'bytes_in': received,
+                'bytes_out': sent,
+            }})
@@ -0,0 +1,5 @@
+from redis import asyncio as aioredis
+
+from src.config import REDIS_HOST, REDIS_PORT
+
+redis = aioredis.from_url(f'redis://{REDIS_HOST}:{REDIS_PORT}', encoding='utf-8', decode_responses=True)